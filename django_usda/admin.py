@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote, FoodDocument, DatasetVersion, NutrientRank
 
 
 class FoodAdmin(admin.ModelAdmin):
@@ -90,3 +90,21 @@ class DeletedFootnoteAdmin(admin.ModelAdmin):
     model = DeletedFootnote
 
 admin.site.register(DeletedFootnote, DeletedFootnoteAdmin)
+
+
+class FoodDocumentAdmin(admin.ModelAdmin):
+    model = FoodDocument
+
+admin.site.register(FoodDocument, FoodDocumentAdmin)
+
+
+class DatasetVersionAdmin(admin.ModelAdmin):
+    model = DatasetVersion
+
+admin.site.register(DatasetVersion, DatasetVersionAdmin)
+
+
+class NutrientRankAdmin(admin.ModelAdmin):
+    model = NutrientRank
+
+admin.site.register(NutrientRank, NutrientRankAdmin)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class DjangoUsdaConfig(AppConfig):
+    name = "django_usda"
+    verbose_name = "Django USDA"
+
+    def ready(self):
+        # Connect the signal handlers that keep the food documents and the dataset version up to date.
+        from . import documents, cache
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from .models import Food
+from .cache import dataVersion
+import heapq
+import re
+
+# Only this many prefix matches are ranked, which keeps one letter queries fast.
+# Every process keeps the index of the current dataset version and rebuilds
+# it when an import or a change of the foods bumps the version.
+prefixScanLimit = 500
+lock = Lock()
+index = None
+
+
+def normalize(text):
+    return " ".join(re.findall(r"\w+", text.lower(), re.UNICODE))
+
+
+def trigrams(text):
+    padded = "  %s " % text
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class AutocompleteIndex(object):
+    """
+    Sorted array of every word-start suffix of the food names for prefix
+    lookups, with a trigram index for fuzzy matching when there are too
+    few prefix matches.
+    """
+
+    def __init__(self, foods, version=None):
+        self.version = version
+        self.foods = []
+        self.trigrams = defaultdict(set)
+        suffixes = []
+        for position, (pk, longDescription, ingredientName) in enumerate(foods):
+            self.foods.append({"id": pk, "long_description": longDescription, "ingredient_name": ingredientName})
+            for name in (longDescription, ingredientName):
+                if not name:
+                    continue
+                text = normalize(name)
+                for match in re.finditer(r"\w+", text, re.UNICODE):
+                    suffixes.append((text[match.start():], match.start(), len(text), position))
+                for trigram in trigrams(text):
+                    self.trigrams[trigram].add(position)
+        suffixes.sort()
+        self.keys = [suffix[0] for suffix in suffixes]
+        self.entries = [suffix[1:] for suffix in suffixes]
+
+    def prefix(self, query, limit):
+        # Matches at the start of a name go first, then shorter names.
+        best = {}
+        start = bisect_left(self.keys, query)
+        for i in xrange(start, min(start + prefixScanLimit, len(self.keys))):
+            if not self.keys[i].startswith(query):
+                break
+            offset, length, position = self.entries[i]
+            score = (offset > 0, length)
+            if position not in best or score < best[position]:
+                best[position] = score
+        return [position for score, position in heapq.nsmallest(limit, ((score, position) for position, score in best.items()))]
+
+    def fuzzy(self, query, limit, exclude=()):
+        queryTrigrams = trigrams(query)
+        hits = defaultdict(int)
+        for trigram in queryTrigrams:
+            for position in self.trigrams.get(trigram, ()):
+                hits[position] += 1
+        threshold = len(queryTrigrams) / 2.0
+        candidates = ((-count, position) for position, count in hits.items() if count >= threshold and position not in exclude)
+        return [position for count, position in heapq.nsmallest(limit, candidates)]
+
+    def complete(self, text, limit=10):
+        query = normalize(text)
+        if not query:
+            return []
+        positions = self.prefix(query, limit)
+        if len(positions) < limit:
+            positions += self.fuzzy(query, limit - len(positions), set(positions))
+        return [self.foods[position] for position in positions]
+
+
+def getIndex():
+    global index
+    version = dataVersion()[0]
+    with lock:
+        if index is None or index.version != version:
+            index = AutocompleteIndex(Food.objects.order_by("pk").values_list("pk", "long_description", "ingredient_name"), version)
+        return index
+
+
+def resetIndex():
+    global index
+    with lock:
+        index = None
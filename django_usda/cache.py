@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from threading import Lock
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote, DatasetVersion
+from .signals import deferred
+import calendar
+import hashlib
+import time
+
+# Responses are cached under the current dataset version: the latest
+# DatasetVersion, which import_r27 and import_sr_delta write, and a counter
+# of the rows saved or deleted through the ORM outside of an import, which
+# only lives in the cache. An import or an edit invalidates every cached
+# response at once. Use a cache shared between processes (memcached,
+# database, ...) for CACHES["default"], edits only reach the processes that
+# share the counter; every process also reads the DatasetVersion again after
+# versionTimeout seconds.
+versionKey = "django_usda:data_version"
+editsKey = "django_usda:data_edits"
+editedKey = "django_usda:data_edited"
+versionTimeout = 30
+versionedModels = (Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink,
+                   DataSource, DeletedFood, DeletedNutrient, DeletedFootnote)
+localCacheSize = 256
+stats = {"local_hits": 0, "hits": 0, "misses": 0, "not_modified": 0}
+lock = Lock()
+
+
+class NotModified(Exception):
+    pass
+
+
+class LocalCache(object):
+    """
+    Least recently used in-process cache in front of the Django cache.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with lock:
+            if key not in self.entries:
+                return None
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+localCache = LocalCache(localCacheSize)
+
+
+def dataVersion():
+    """
+    The (tag, modified timestamp) of the latest DatasetVersion and the edits since.
+    """
+    cached = cache.get_many([versionKey, editsKey, editedKey])
+    version = cached.get(versionKey)
+    if version is None:
+        latest = DatasetVersion.objects.values_list("pk", "changed").first()
+        if latest is None:
+            version = ("0", 0)
+        else:
+            modified = calendar.timegm(latest[1].utctimetuple())
+            version = ("%s.%s.%s" % (latest[0], modified, latest[1].microsecond), modified)
+        cache.set(versionKey, version, versionTimeout)
+    if editsKey in cached:
+        version = ("%s-%s" % (version[0], cached[editsKey]), max(version[1], cached.get(editedKey, 0)))
+    return version
+
+
+def bumpDataVersion():
+    """
+    Forget the cached version after a new DatasetVersion has been written.
+    """
+    cache.delete(versionKey)
+
+
+def touchDataVersion():
+    """
+    Change the version after rows were written outside of an import.
+    """
+    # Starts at the current time, so a counter that was evicted does not repeat an earlier tag.
+    cache.add(editsKey, int(time.time() * 1000), None)
+    try:
+        cache.incr(editsKey)
+    except ValueError:
+        cache.set(editsKey, int(time.time() * 1000), None)
+    cache.set(editedKey, int(time.time()), None)
+
+
+def dataChanged(sender, raw=False, **kwargs):
+    if not raw and not deferred():
+        touchDataVersion()
+
+
+for model in versionedModels:
+    post_save.connect(dataChanged, sender=model, dispatch_uid="django_usda_version_save_%s" % model.__name__)
+    post_delete.connect(dataChanged, sender=model, dispatch_uid="django_usda_version_delete_%s" % model.__name__)
+
+
+def count(name):
+    with lock:
+        stats[name] += 1
+
+
+def cacheStats():
+    with lock:
+        return dict(stats)
+
+
+class ConditionalGetMixin(object):
+    """
+    Strong ETag of the dataset version, the request URL and the accepted media
+    types, and a 304 for matching conditional requests before the view reads
+    any data.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        if request.method in ("GET", "HEAD"):
+            tag, self.modified = dataVersion()
+            self.etag = '"%s"' % hashlib.md5("%s:%s:%s" % (
+                tag, request.get_full_path().encode("utf-8"), request.META.get("HTTP_ACCEPT", ""))).hexdigest()
+            if self.notModified(request):
+                count("not_modified")
+                raise NotModified()
+
+    def notModified(self, request):
+        if request.META.get("HTTP_IF_NONE_MATCH"):
+            return self.etag in [tag.strip() for tag in request.META["HTTP_IF_NONE_MATCH"].split(",")]
+        since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        return since is not None and since >= self.modified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=304)
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method in ("GET", "HEAD") and response.status_code in (200, 304) and hasattr(self, "etag"):
+            response["ETag"] = self.etag
+            response["Last-Modified"] = http_date(self.modified)
+        return super(ConditionalGetMixin, self).finalize_response(request, response, *args, **kwargs)
+
+
+class CachedReadMixin(ConditionalGetMixin):
+    """
+    Serves list and retrieve from the cache.
+    """
+
+    def cached(self, request, read, *args, **kwargs):
+        key = "django_usda:view:%s" % self.etag.strip('"')
+        data = localCache.get(key)
+        if data is not None:
+            count("local_hits")
+        else:
+            data = cache.get(key)
+            if data is not None:
+                count("hits")
+            else:
+                count("misses")
+                data = read(request, *args, **kwargs).data
+                cache.set(key, data, None)
+            localCache.set(key, data)
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, super(CachedReadMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, super(CachedReadMixin, self).retrieve, *args, **kwargs)
@@ -0,0 +1,135 @@
+from collections import Counter
+from threading import local
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from rest_framework.renderers import JSONRenderer
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Weight, Footnote, DataLink, DataSource, FoodDocument
+from .serializers import FoodInfoSerializer, foodInfoPrefetch
+from .signals import deferred
+
+# Kept small so the prefetch IN lists stay below the SQLite variable limit.
+documentBatchSize = 500
+# The foods that are being deleted, or whose related rows are deleted
+# together with a reference row. Their documents are refreshed once, when
+# the whole delete is done, instead of once per deleted row.
+state = local()
+# The foods whose documents embed a reference row, by the model of the row.
+referencingFoods = {
+    FoodGroup: lambda pk: Food.objects.filter(food_group=pk).values_list("pk", flat=True),
+    Nutrient: lambda pk: NutrientData.objects.filter(nutrient=pk).values_list("food", flat=True),
+    Source: lambda pk: NutrientData.objects.filter(data_type=pk).values_list("food", flat=True),
+    LanguaLFactor: lambda pk: FoodLanguaLFactor.objects.filter(langual_factor=pk).values_list("food", flat=True),
+    DataSource: lambda pk: DataLink.objects.filter(data_source=pk).values_list("food", flat=True),
+}
+
+
+def createDocuments(ids):
+    """
+    Store the foods as JSON in the shape of the foodinfo endpoint. One
+    serializer for all foods, its fields are only built once.
+    """
+    foods = Food.objects.filter(pk__in=ids).select_related("food_group").prefetch_related(*foodInfoPrefetch)
+    renderer = JSONRenderer()
+    FoodDocument.objects.bulk_create([FoodDocument(food_id=food["id"], document=renderer.render(food))
+                                      for food in FoodInfoSerializer(foods, many=True).data])
+
+
+def buildDocuments(batchSize=documentBatchSize):
+    with transaction.atomic():
+        FoodDocument.objects.all().delete()
+        ids = list(Food.objects.order_by("pk").values_list("pk", flat=True))
+        for start in xrange(0, len(ids), batchSize):
+            createDocuments(ids[start:start + batchSize])
+    return len(ids)
+
+
+def deleting():
+    if not hasattr(state, "deleting"):
+        state.deleting = Counter()
+    return state.deleting
+
+
+def holdDocuments(ids):
+    for pk in ids:
+        deleting()[pk] += 1
+
+
+def releaseDocuments(ids):
+    for pk in ids:
+        deleting()[pk] -= 1
+        if deleting()[pk] <= 0:
+            del deleting()[pk]
+
+
+def refreshDocuments(ids, batchSize=documentBatchSize):
+    if deferred():
+        return
+    ids = sorted(pk for pk in set(ids) if not deleting()[pk])
+    with transaction.atomic():
+        for start in xrange(0, len(ids), batchSize):
+            FoodDocument.objects.filter(pk__in=ids[start:start + batchSize]).delete()
+            createDocuments(ids[start:start + batchSize])
+
+
+@receiver(pre_delete, sender=Food)
+def startFoodDelete(sender, instance, **kwargs):
+    holdDocuments([instance.pk])
+
+
+@receiver(post_delete, sender=Food)
+def endFoodDelete(sender, instance, **kwargs):
+    releaseDocuments([instance.pk])
+
+
+@receiver(post_save, sender=FoodGroup)
+@receiver(post_save, sender=Nutrient)
+@receiver(post_save, sender=Source)
+@receiver(post_save, sender=LanguaLFactor)
+@receiver(post_save, sender=DataSource)
+def refreshReferencingDocuments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refreshDocuments(referencingFoods[sender](instance.pk))
+
+
+@receiver(pre_delete, sender=FoodGroup)
+@receiver(pre_delete, sender=Nutrient)
+@receiver(pre_delete, sender=Source)
+@receiver(pre_delete, sender=LanguaLFactor)
+@receiver(pre_delete, sender=DataSource)
+def startReferenceDelete(sender, instance, **kwargs):
+    # The related rows are deleted first, their own receivers skip these foods.
+    instance._referencingFoods = set() if deferred() else set(referencingFoods[sender](instance.pk))
+    holdDocuments(instance._referencingFoods)
+
+
+@receiver(post_delete, sender=FoodGroup)
+@receiver(post_delete, sender=Nutrient)
+@receiver(post_delete, sender=Source)
+@receiver(post_delete, sender=LanguaLFactor)
+@receiver(post_delete, sender=DataSource)
+def endReferenceDelete(sender, instance, **kwargs):
+    foods = getattr(instance, "_referencingFoods", set())
+    releaseDocuments(foods)
+    refreshDocuments(foods)
+
+
+@receiver(post_save, sender=Food)
+def refreshDocument(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refreshDocuments([instance.pk])
+
+
+@receiver(post_save, sender=NutrientData)
+@receiver(post_save, sender=Weight)
+@receiver(post_save, sender=Footnote)
+@receiver(post_save, sender=FoodLanguaLFactor)
+@receiver(post_save, sender=DataLink)
+@receiver(post_delete, sender=NutrientData)
+@receiver(post_delete, sender=Weight)
+@receiver(post_delete, sender=Footnote)
+@receiver(post_delete, sender=FoodLanguaLFactor)
+@receiver(post_delete, sender=DataLink)
+def refreshFoodDocument(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refreshDocuments([instance.food_id])
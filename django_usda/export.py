@@ -0,0 +1,74 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ParseError
+from cStringIO import StringIO
+import csv
+import json
+
+# Rows are read by primary key in batches of this size, which keeps the
+# memory use constant on every database (Django 1.8 has no server-side
+# cursors, and the PostgreSQL driver buffers a whole result set).
+exportBatchSize = 5000
+
+
+def batches(queryset, columns, batchSize=exportBatchSize):
+    pk = queryset.model._meta.pk.attname
+    position = columns.index(pk)
+    queryset = queryset.order_by(pk).values_list(*columns)
+    last = None
+    while True:
+        batch = list(queryset[:batchSize] if last is None else queryset.filter(**{"%s__gt" % pk: last})[:batchSize])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1][position]
+
+
+def encode(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+def ndjsonLines(queryset, columns, names):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for batch in batches(queryset, columns):
+        yield "".join(encoder.encode(dict(zip(names, row))) + "\n" for row in batch)
+
+
+def csvLines(queryset, columns, names):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in batches(queryset, columns):
+        writer.writerows([[encode(value) for value in row] for row in batch])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+exportFormats = {
+    "ndjson": (ndjsonLines, "application/x-ndjson"),
+    "csv": (csvLines, "text/csv; charset=utf-8"),
+}
+
+
+class ExportMixin(object):
+    """
+    Streams the whole table, or the filtered rows, as NDJSON or CSV from
+    /<endpoint>/export/?output=csv without running a serializer.
+    """
+
+    @list_route()
+    def export(self, request):
+        output = request.GET.get("output", "ndjson")
+        if output not in exportFormats:
+            raise ParseError("output must be one of %s." % ", ".join(sorted(exportFormats)))
+        model = self.get_queryset().model
+        fields = model._meta.concrete_fields
+        lines, contentType = exportFormats[output]
+        queryset = self.filter_queryset(model.objects.all())
+        response = StreamingHttpResponse(lines(queryset, [field.attname for field in fields], [field.name for field in fields]),
+                                         content_type=contentType)
+        response["Content-Disposition"] = "attachment; filename=%s.%s" % (model._meta.db_table, output)
+        return response
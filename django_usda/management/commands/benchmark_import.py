@@ -0,0 +1,149 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from django_usda.management.commands.import_r27 import modelMap, engines, chunkSize, srColumns, fieldPlan, compileDecoder, converters, readLines
+from django.db import connection, transaction
+import zipfile
+import time
+import sys
+import os
+
+
+class Rollback(Exception):
+    pass
+
+
+def emptyTables():
+    cursor = connection.cursor()
+    for info in reversed(modelMap):
+        cursor.execute("DELETE FROM %s" % connection.ops.quote_name(info["model"]._meta.db_table))
+
+
+def timeEngine(zipPath, engine, batchSize):
+    """
+    Load every file of modelMap with the engine into empty tables and return
+    the (seconds, rows) of the load. Everything is rolled back afterwards,
+    so the engines are timed on the same database.
+    """
+    openedZipFile = zipfile.ZipFile(zipPath)
+    result = {}
+    try:
+        with transaction.atomic():
+            emptyTables()
+            start = time.time()
+            for info in modelMap:
+                engines[engine](openedZipFile.open(info["fileName"]), info["fileName"], info["model"], batchSize)
+            result["seconds"] = time.time() - start
+            result["rows"] = sum(info["model"].objects.count() for info in modelMap)
+            raise Rollback()
+    except Rollback:
+        pass
+    finally:
+        openedZipFile.close()
+    return result["seconds"], result["rows"]
+
+
+def interpretedDecoder(plan, fileName):
+    """
+    Decodes a row by looking up the column and the type of every field for
+    each value, the baseline of the compiled decoder.
+    """
+    columns = srColumns[fileName]
+
+    def decode(values):
+        row = []
+        for field, key, fieldType in plan:
+            if field.column not in columns:
+                row.append(field.get_default())
+                continue
+            value = values[columns.index(field.column)]
+            if fieldType == "BooleanField":
+                row.append(value == "Y")
+            elif value == "":
+                if not field.null and not field.blank:
+                    raise ValueError("%s: Field required but null given." % field.name)
+                row.append(None)
+            else:
+                row.append(converters.get(fieldType, str)(value))
+        return row
+    return decode
+
+
+def timeDecoders(zipPath):
+    """
+    (fileName, rows, seconds of the interpreted decoder, seconds of the
+    compiled decoder) of every file of modelMap. The lines are split
+    beforehand, so only the decoding is timed.
+    """
+    openedZipFile = zipfile.ZipFile(zipPath)
+    results = []
+    for info in modelMap:
+        lines = list(readLines(openedZipFile.open(info["fileName"])))
+        plan = fieldPlan(info["model"])
+        times = []
+        for decode in (interpretedDecoder(plan, info["fileName"]), compileDecoder(plan, info["fileName"])):
+            start = time.time()
+            for values in lines:
+                try:
+                    decode(values)
+                except ValueError:
+                    pass
+            times.append(time.time() - start)
+        results.append((info["fileName"], len(lines), times[0], times[1]))
+    openedZipFile.close()
+    return results
+
+
+class Command(BaseCommand):
+    args = "<zipFile>"
+    help = 'Time the import_r27 engines against the orm (bulk_create) engine on the same zip, every run is rolled back'
+    option_list = BaseCommand.option_list + (
+        make_option("--engines", dest="engines", default=",".join(sorted(engines.keys())),
+                    help="Comma separated engines to time, orm is always timed as the baseline."),
+        make_option("--batch-size", dest="batchSize", type="int", default=chunkSize,
+                    help="Number of rows to send to the database per bulk insert."),
+        make_option("--decode", dest="decode", action="store_true", default=False,
+                    help="Only time decoding the rows of every file, compiled against interpreted, without the database."),
+        make_option("--repeat", dest="repeat", type="int", default=3,
+                    help="Number of runs per engine, the fastest one is reported."),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Usage: benchmark_import %s" % self.args)
+        if options["decode"]:
+            runs = [timeDecoders(args[0]) for run in xrange(options["repeat"])]
+            print "Decoded every file, fastest of %s runs:" % options["repeat"]
+            totals = [0, 0, 0]
+            for results in zip(*runs):
+                fileName, rows = results[0][:2]
+                interpreted, compiled = min(result[2] for result in results), min(result[3] for result in results)
+                totals = [totals[0] + rows, totals[1] + interpreted, totals[2] + compiled]
+                print "%-14s %8d rows %10d rows/sec interpreted %10d rows/sec compiled" % (
+                    fileName, rows, rows / interpreted if interpreted else 0, rows / compiled if compiled else 0)
+            print "%-14s %8d rows %10d rows/sec interpreted %10d rows/sec compiled" % (
+                "total", totals[0], totals[0] / totals[1] if totals[1] else 0, totals[0] / totals[2] if totals[2] else 0)
+            return
+        names = ["orm"] + [name for name in options["engines"].split(",") if name and name != "orm"]
+        unknown = [name for name in names if name not in engines]
+        if unknown:
+            raise CommandError("Unknown engines: %s." % ", ".join(unknown))
+        results = {}
+        for name in names:
+            runs = []
+            for run in xrange(options["repeat"]):
+                # The engines report every batch, only the summary below is of interest.
+                stdout = sys.stdout
+                if int(options["verbosity"]) < 2:
+                    sys.stdout = open(os.devnull, "w")
+                try:
+                    runs.append(timeEngine(args[0], name, options["batchSize"]))
+                finally:
+                    if sys.stdout is not stdout:
+                        sys.stdout.close()
+                        sys.stdout = stdout
+            results[name] = min(runs)
+        print "Loaded %s rows in batches of %s on %s, fastest of %s runs:" % (results["orm"][1], options["batchSize"], connection.vendor, options["repeat"])
+        for name in names:
+            seconds, rows = results[name]
+            print "%-8s %8.2fs %10d rows/sec %6.2fx orm%s" % (name, seconds, rows / seconds if seconds else 0, results["orm"][0] / seconds if seconds else 0,
+                                                          "" if rows == results["orm"][1] else " (loaded %s rows)" % rows)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import time
+
+chunkSize = 5000
+
+
+class Command(BaseCommand):
+    args = "<directory>"
+    help = 'Export every table as a memory-mappable Arrow file, load it with django_usda.snapshot.loadSnapshot'
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", dest="batchSize", type="int", default=chunkSize,
+                    help="Number of rows to read from the database and write as one record batch."),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Usage: export_snapshot %s" % self.args)
+        try:
+            from django_usda.snapshot import exportSnapshot
+        except ImportError:
+            raise CommandError("export_snapshot requires pyarrow, install django_usda[snapshot].")
+        start = time.time()
+        manifest = exportSnapshot(args[0], options["batchSize"])
+        for name, table in sorted(manifest["tables"].items()):
+            print "Wrote %s rows of %s to '%s'." % (table["rows"], name, table["file"])
+        print "Exported the snapshot in %.2fs." % (time.time() - start)
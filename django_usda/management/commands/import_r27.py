@@ -1,14 +1,43 @@
 from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
 from django.db.models.loading import get_model
-from django_usda.models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote
+from django_usda.documents import buildDocuments
+from django_usda.signals import deferSignals
+from django_usda.search import buildSearchIndex
+from django_usda.autocomplete import resetIndex
+from django_usda.cache import bumpDataVersion
+from django_usda.rankings import buildRankings
+try:
+    from django_usda.matrix import buildMatrix
+    from django_usda.similarity import buildSimilarityIndex
+except ImportError:
+    buildMatrix = None
+from django_usda.models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote, DatasetVersion
 import zipfile
 import csv
 import json
 import time
-from django.db import IntegrityError
+import multiprocessing
+import Queue
+import hashlib
+import itertools
+import cPickle
+import struct
+import zlib
+import os
+from django.db import IntegrityError, connection, transaction
 from django import db
+from cStringIO import StringIO
+from decimal import Decimal
 
 appLabel = "django_usda"
+chunkSize = 50000
+# Kept small so the IN lists stay below the SQLite variable limit.
+upsertLookupSize = 500
+# Seconds to wait for the next file of a parallel import before giving up.
+taskTimeout = 3600
+# Bumped when the layout of the preprocessed rows changes, older files are then rebuilt.
+preprocessedFormat = 2
 
 modelMap = [
     {"fileName": "DATA_SRC.txt", 	"model": DataSource},
@@ -25,88 +54,730 @@ modelMap = [
     {"fileName": "DATSRCLN.txt",	"model": DataLink}
 ]
 
-
-def filter(value):
-    newValue = value.replace("\r\n", "")
-    if newValue == "":
-        return None
-    return newValue
+# The columns of every SR file, as listed in the SR27 documentation. A column
+# is loaded into the field with the same db_column, the other columns are
+# skipped and fields without a column get their default.
+foodColumns = ("NDB_No", "FdGrp_Cd", "Long_Desc", "Shrt_Desc", "ComName", "ManufacName", "Survey", "Ref_desc", "Refuse", "SciName",
+               "N_Factor", "Pro_Factor", "Fat_Factor", "CHO_Factor")
+nutrientDataColumns = ("NDB_No", "Nutr_No", "Nutr_Val", "Num_Data_Pts", "Std_Error", "Src_Cd", "Deriv_Cd", "Ref_NDB_No", "Add_Nutr_Mark",
+                       "Num_Studies", "Min", "Max", "DF", "Low_EB", "Up_EB", "Stat_cmt", "AddMod_Date", "CC")
+nutrientColumns = ("Nutr_No", "Units", "Tagname", "NutrDesc", "Num_Dec", "SR_Order")
+weightColumns = ("NDB_No", "Seq", "Amount", "Msre_Desc", "Gm_Wgt", "Num_Data_Pts", "Std_Dev")
+footnoteColumns = ("NDB_No", "Footnt_No", "Footnt_Typ", "Nutr_No", "Footnt_Txt")
+foodLanguaLColumns = ("NDB_No", "Factor_Code")
+srColumns = {
+    "DATA_SRC.txt": ("DataSrc_ID", "Authors", "Title", "Year", "Journal", "Vol_City", "Issue_State", "Start_Page", "End_Page"),
+    "FD_GROUP.txt": ("FdGrp_Cd", "FdGrp_Desc"),
+    "FOOD_DES.txt": foodColumns,
+    "LANGDESC.txt": ("Factor_Code", "Description"),
+    "LANGUAL.txt": foodLanguaLColumns,
+    "NUTR_DEF.txt": nutrientColumns,
+    "DERIV_CD.txt": ("Deriv_Cd", "Deriv_Desc"),
+    "SRC_CD.txt": ("Src_Cd", "SrcCd_Desc"),
+    "NUT_DATA.txt": nutrientDataColumns,
+    "WEIGHT.txt": weightColumns,
+    "FOOTNOTE.txt": footnoteColumns,
+    "DATSRCLN.txt": ("NDB_No", "Nutr_No", "DataSrc_ID"),
+    # The files of the update releases, see import_sr_delta.
+    "ADD_NDEF.txt": nutrientColumns,
+    "CHG_NDEF.txt": nutrientColumns,
+    "ADD_FOOD.txt": foodColumns,
+    "CHG_FOOD.txt": foodColumns,
+    "ADD_NUTR.txt": nutrientDataColumns,
+    "CHG_NUTR.txt": nutrientDataColumns,
+    "ADD_WGT.txt": weightColumns,
+    "CHG_WGT.txt": weightColumns,
+    "ADD_FTNT.txt": footnoteColumns,
+    "ADD_LANG.txt": foodLanguaLColumns,
+    "DEL_FTNT.txt": ("NDB_No", "Footnt_No", "Footnt_Typ"),
+    "DEL_NUTR.txt": ("NDB_No", "Nutr_No"),
+    "DEL_WGT.txt": weightColumns,
+    "DEL_FOOD.txt": ("NDB_No", "Shrt_Desc"),
+}
 
 
-def importFile(file, model):
-    contents = file.readlines()
-    bulk = []
-    print "Creating objects."
-    for counter, line in enumerate(contents):
-        values = line.replace("~", "").decode(
+def readLines(file):
+    for line in file:
+        yield line.rstrip("\r\n").replace("~", "").decode(
             'iso-8859-1').encode('utf8').split("^")
-        fields = list(model._meta.fields)
-        if fields[0].get_internal_type() == "AutoField":
-            del fields[0]
-        newModel = createObject(model, fields, values)
+
+
+def fieldPlan(model):
+    fields = list(model._meta.fields)
+    if fields[0].get_internal_type() == "AutoField":
+        del fields[0]
+    plan = []
+    for field in fields:
+        key = field.name
+        fieldType = field.get_internal_type()
+        if fieldType == "ForeignKey":
+            key = key + "_id"
+            fieldType = field.rel.get_related_field().get_internal_type()
+        plan.append((field, key, fieldType))
+    return plan
+
+
+def fileFields(plan, fileName):
+    """
+    The part of plan that has a column in fileName.
+    """
+    columns = srColumns[fileName]
+    return [(field, key, fieldType) for field, key, fieldType in plan if field.column in columns]
+
+
+def toText(value):
+    return value or None
+
+
+def toBoolean(value):
+    return value == "Y"
+
+
+def nullable(convert):
+    def convertNullable(value):
+        if value == "":
+            return None
+        return convert(value)
+    return convertNullable
+
+
+def required(field, convert):
+    def convertRequired(value):
+        if value == "":
+            raise ValueError("%s: Field required but null given." % field.name)
+        return convert(value)
+    return convertRequired
+
+
+converters = {
+    "FloatField": float,
+    "DecimalField": Decimal,
+    "IntegerField": int,
+    "SmallIntegerField": int,
+    "BigIntegerField": int,
+    "PositiveIntegerField": int,
+    "PositiveSmallIntegerField": int,
+}
+
+
+def constant(value):
+    def convertConstant(ignored):
+        return value
+    return convertConstant
+
+
+def compileDecoder(plan, fileName):
+    """
+    Decoder of the rows of fileName into the values of the plan fields, in plan order.
+    """
+    columns = srColumns[fileName]
+    positions = dict((name, position) for position, name in enumerate(columns))
+    table = []
+    for field, key, fieldType in plan:
+        if field.column not in positions:
+            table.append((0, constant(field.get_default())))
+            continue
+        if fieldType == "BooleanField":
+            convert = toBoolean
+        elif fieldType in converters:
+            convert = nullable(converters[fieldType])
+        else:
+            convert = toText
+        if not field.null and not field.blank and fieldType != "BooleanField":
+            convert = required(field, convert)
+        table.append((positions[field.column], convert))
+    width = len(columns)
+
+    def decode(values):
+        if len(values) != width:
+            if len(values) > width:
+                raise ValueError("%s values given for the %s columns of %s." % (len(values), width, fileName))
+            # Missing trailing columns are empty.
+            values = values + [""] * (width - len(values))
+        return [convert(values[position]) for position, convert in table]
+    return decode
+
+
+def newCounts():
+    return {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0}
+
+
+def importFile(file, fileName, model, batchSize=chunkSize):
+    plan = fieldPlan(model)
+    keys = [key for field, key, fieldType in plan]
+    decode = compileDecoder(plan, fileName)
+    counts = newCounts()
+    batch = []
+    total = 0
+    start = time.time()
+    print "Creating and importing objects in batches of %s." % batchSize
+    for values in readLines(file):
+        newModel = createObject(model, keys, decode, values)
         if newModel:
-            bulk.append(newModel)
-    importObjects(model, bulk)
+            batch.append(newModel)
+        else:
+            counts["rejected"] += 1
+        if len(batch) >= batchSize:
+            importChunk(model, batch, counts)
+            total += len(batch)
+            print "Imported %s objects into the database." % total
+            batch = []
+            db.reset_queries()
+    if batch:
+        importChunk(model, batch, counts)
+        total += len(batch)
+    reportRate(model, total, time.time() - start)
+    reportCounts(counts)
 
 
-def importObjects(model, bulk):
-    length = len(bulk)
-    chunkSize = 50000
-    if length > chunkSize:
-        for counter, chunk in enumerate(chunks(bulk, chunkSize)):
-            print "Importing %s/%s objects into the database." % (counter * chunkSize + len(chunk), length)
-            importChunk(model, chunk)
-    else:
-        print "Importing %s objects into the database." % len(bulk)
-        importChunk(model, bulk)
+def reportRate(model, total, elapsed):
+    rate = total / elapsed if elapsed else 0
+    print "Imported %s %s in %.2fs (%d rows/sec)." % (total, model._meta.verbose_name_plural.title(), elapsed, rate)
 
 
-def importChunk(model, chunk):
+def reportCounts(counts):
+    print "Inserted %(inserted)s, updated %(updated)s, left %(unchanged)s unchanged and rejected %(rejected)s rows." % counts
+
+
+def importChunk(model, chunk, counts, checked=False):
+    # Split a failing chunk in halves until only the offending rows are left.
     try:
-        model.objects.bulk_create(chunk)
+        with transaction.atomic():
+            model.objects.bulk_create(chunk)
+        counts["inserted"] += len(chunk)
     except IntegrityError as e:
-        if "Duplicate entry" not in str(e):
+        if len(chunk) > 1:
+            if not checked:
+                # Rows that are already in the table are rejected at once, re-running
+                # an import would otherwise split every chunk down to single rows.
+                fresh = withoutExisting(model, chunk, counts)
+                if len(fresh) < len(chunk):
+                    if fresh:
+                        importChunk(model, fresh, counts, True)
+                    return
+            half = len(chunk) // 2
+            importChunk(model, chunk[:half], counts, True)
+            importChunk(model, chunk[half:], counts, True)
+            return
+        counts["rejected"] += 1
+        if not isDuplicate(e):
             print "Database Error: %s" % e
             print chunk
 
 
-def createObject(model, fields, values):
-    linkedFields = {}
+def isDuplicate(error):
+    message = str(error)
+    return "Duplicate entry" in message or "UNIQUE constraint" in message or "duplicate key" in message
+
+
+def createObject(model, keys, decode, values):
     try:
-        for counter, value in enumerate(values):
-            value = filter(value)
-            field = fields[counter]
-            key = field.name
-            if not field.null and value == "":
-                raise Exception(
-                    "%s: Field required but null given." % field.name)
-            fieldType = field.get_internal_type()
-            if fieldType == "ForeignKey":
-                key = key + "_id"
-            elif fieldType == "BooleanField":
-                value = False
-                if value == "Y":
-                    value = True
-            linkedFields[key] = value
-        return model(**linkedFields)
+        return model(**dict(zip(keys, decode(values))))
     except Exception as e:
         print "Model creation error for pk '%s': %s" % (values[0], e)
     return False
 
 
+def naturalKey(model, plan):
+    keys = dict((field.name, key) for field, key, fieldType in plan)
+    uniqueTogether = model._meta.unique_together
+    if uniqueTogether:
+        return tuple(keys[name] for name in uniqueTogether[0])
+    if model._meta.pk.name in keys:
+        return (model._meta.pk.name,)
+    return None
+
+
+def withoutExisting(model, chunk, counts):
+    """
+    The objects of chunk whose natural key is not in the table yet, the others are counted as rejected.
+    """
+    keys = naturalKey(model, fieldPlan(model))
+    if keys is None:
+        return chunk
+    rows = [dict((key, getattr(obj, key)) for key in keys) for obj in chunk]
+    existing = set()
+    for part in chunks(rows, upsertLookupSize):
+        existing.update(existingRows(model, keys, keys, part, keys))
+    fresh = [obj for obj, row in zip(chunk, rows) if tuple(row[key] for key in keys) not in existing]
+    counts["rejected"] += len(chunk) - len(fresh)
+    return fresh
+
+
+def existingRows(model, keys, targetKeys, batch, fields):
+    # Narrow down on the first key only and match the full key in Python.
+    first = set(row[keys[0]] for row in batch)
+    existing = {}
+    for current in model.objects.filter(**{targetKeys[0] + "__in": first}).values("pk", *fields):
+        existing[tuple(current[targetKey] for targetKey in targetKeys)] = current
+    return existing
+
+
+def upsertBatch(model, keys, batch, counts):
+    existing = {}
+    for chunk in chunks(batch, upsertLookupSize):
+        existing.update(existingRows(model, keys, keys, chunk, batch[0].keys()))
+    created = []
+    for row in batch:
+        current = existing.get(tuple(row[key] for key in keys))
+        if current is None:
+            created.append(model(**row))
+            continue
+        changes = dict((key, value) for key, value in row.items() if current[key] != value)
+        if changes:
+            model.objects.filter(pk=current["pk"]).update(**changes)
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+    if created:
+        importChunk(model, created, counts)
+
+
 def chunks(l, n):
     for i in xrange(0, len(l), n):
         yield l[i:i + n]
 
 
+def readRows(file, fileName, plan, counts):
+    """
+    The rows of fileName as dicts of the plan fields that have a column in the file.
+    """
+    plan = fileFields(plan, fileName)
+    keys = [key for field, key, fieldType in plan]
+    decode = compileDecoder(plan, fileName)
+    for values in readLines(file):
+        try:
+            row = decode(values)
+        except Exception as e:
+            print "Model creation error for pk '%s': %s" % (values[0], e)
+            counts["rejected"] += 1
+            continue
+        yield dict(zip(keys, [value.decode("utf8") if isinstance(value, str) else value for value in row]))
+
+
+def replaceFile(file, fileName, model, batchSize=chunkSize):
+    """
+    Replace the rows of every food in the file in one transaction, for
+    tables without a natural key to match the rows on.
+    """
+    plan = fileFields(fieldPlan(model), fileName)
+    if "food_id" not in [key for field, key, fieldType in plan]:
+        raise CommandError("%s have no natural key and no food to replace them by, --engine=upsert cannot load them." %
+                           model._meta.verbose_name_plural.title())
+    counts = newCounts()
+    replaced = set()
+    removed = 0
+    total = 0
+    start = time.time()
+    print "%s have no natural key, replacing the rows of every food in the file." % model._meta.verbose_name_plural.title()
+    with transaction.atomic():
+        for batch in chunks(list(readRows(file, fileName, plan, counts)), batchSize):
+            foods = sorted(set(row["food_id"] for row in batch) - replaced)
+            for part in chunks(foods, upsertLookupSize):
+                stale = model.objects.filter(food__in=part)
+                removed += stale.count()
+                stale.delete()
+            replaced.update(foods)
+            importChunk(model, [model(**row) for row in batch], counts)
+            total += len(batch)
+            db.reset_queries()
+    reportRate(model, total, time.time() - start)
+    print "Replaced %s rows of %s foods." % (removed, len(replaced)),
+    reportCounts(counts)
+
+
+def upsertFile(file, fileName, model, batchSize=chunkSize):
+    plan = fieldPlan(model)
+    key = naturalKey(model, plan)
+    if key is None:
+        return replaceFile(file, fileName, model, batchSize)
+    counts = newCounts()
+    batch = []
+    total = 0
+    start = time.time()
+    print "Inserting or updating objects on %s in batches of %s." % (", ".join(key), batchSize)
+    for row in readRows(file, fileName, plan, counts):
+        batch.append(row)
+        if len(batch) >= batchSize:
+            upsertBatch(model, key, batch, counts)
+            total += len(batch)
+            print "Imported %s objects into the database." % total
+            batch = []
+            db.reset_queries()
+    if batch:
+        upsertBatch(model, key, batch, counts)
+        total += len(batch)
+    reportRate(model, total, time.time() - start)
+    reportCounts(counts)
+
+
+def createRow(decode, values):
+    try:
+        return decode(values)
+    except Exception as e:
+        print "Row creation error for pk '%s': %s" % (values[0], e)
+    return None
+
+
+def insertTarget(model, plan):
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field, key, fieldType in plan)
+    return table, columns
+
+
+def bulkLoader():
+    if connection.vendor == "postgresql":
+        return copyChunk
+    return executeChunk
+
+
+def copyFile(file, fileName, model, batchSize=chunkSize):
+    plan = fieldPlan(model)
+    decode = compileDecoder(plan, fileName)
+    table, columns = insertTarget(model, plan)
+    load = bulkLoader()
+    batch = []
+    total = 0
+    start = time.time()
+    print "Loading rows with %s in batches of %s." % (load.__name__, batchSize)
+    try:
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for values in readLines(file):
+                row = createRow(decode, values)
+                if row is not None:
+                    batch.append(row)
+                if len(batch) >= batchSize:
+                    load(cursor, table, columns, batch)
+                    total += len(batch)
+                    print "Loaded %s rows into the database." % total
+                    batch = []
+            if batch:
+                load(cursor, table, columns, batch)
+                total += len(batch)
+    except IntegrityError as e:
+        print "Database Error, rolled back %s: %s" % (model._meta.db_table, e)
+        return False
+    reportRate(model, total, time.time() - start)
+
+
+def copyValue(value):
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, unicode):
+        value = value.encode("utf8")
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copyChunk(cursor, table, columns, chunk):
+    buffer = StringIO()
+    for row in chunk:
+        buffer.write("\t".join(copyValue(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table, columns), buffer)
+
+
+def executeChunk(cursor, table, columns, chunk):
+    placeholders = ", ".join(["%s"] * len(chunk[0]))
+    rows = [[value.decode("utf8") if isinstance(value, str) else value for value in row] for row in chunk]
+    cursor.executemany("INSERT INTO %s (%s) VALUES (%s)" % (table, columns, placeholders), rows)
+
+
+def zipChecksum(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def writeFrame(file, value):
+    data = zlib.compress(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL), 1)
+    file.write(struct.pack("<I", len(data)))
+    file.write(data)
+
+
+def readFrames(file):
+    while True:
+        size = file.read(4)
+        if not size:
+            return
+        yield cPickle.loads(zlib.decompress(file.read(struct.unpack("<I", size)[0])))
+
+
+def preprocessedHeader(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        return next(readFrames(file), None)
+
+
+def writePreprocessed(zipPath, path, batchSize=chunkSize):
+    """
+    Decode every file of modelMap once and store the typed rows as compressed
+    (fileName, rows) frames after a header with the checksum of the zip.
+    """
+    openedZipFile = zipfile.ZipFile(zipPath)
+    with open(path + ".tmp", "wb") as file:
+        writeFrame(file, {"format": preprocessedFormat, "checksum": zipChecksum(zipPath)})
+        for info in modelMap:
+            decode = compileDecoder(fieldPlan(info["model"]), info["fileName"])
+            batch = []
+            for values in readLines(openedZipFile.open(info["fileName"])):
+                row = createRow(decode, values)
+                if row is not None:
+                    batch.append(row)
+                if len(batch) >= batchSize:
+                    writeFrame(file, (info["fileName"], batch))
+                    batch = []
+            writeFrame(file, (info["fileName"], batch))
+    openedZipFile.close()
+    os.rename(path + ".tmp", path)
+
+
+def loadPreprocessed(path):
+    models = dict((info["fileName"], info["model"]) for info in modelMap)
+    load = bulkLoader()
+    cursor = connection.cursor()
+    with open(path, "rb") as file:
+        frames = readFrames(file)
+        next(frames)
+        for fileName, group in itertools.groupby(frames, key=lambda frame: frame[0]):
+            model = models[fileName]
+            table, columns = insertTarget(model, fieldPlan(model))
+            print "Loading '%s' as %s from the preprocessed file." % (fileName, model._meta.verbose_name_plural.title())
+            total = 0
+            start = time.time()
+            try:
+                with transaction.atomic():
+                    for fileName, rows in group:
+                        if rows:
+                            load(cursor, table, columns, rows)
+                            total += len(rows)
+            except IntegrityError as e:
+                print "Database Error, rolled back %s: %s" % (model._meta.db_table, e)
+                continue
+            reportRate(model, total, time.time() - start)
+
+
+engines = {
+    "orm": importFile,
+    "copy": copyFile,
+    "upsert": upsertFile,
+}
+
+
+def dependencies(modelMap):
+    fileNames = dict((info["model"], info["fileName"]) for info in modelMap)
+    graph = {}
+    for info in modelMap:
+        parents = set()
+        for field in info["model"]._meta.fields:
+            if field.get_internal_type() == "ForeignKey" and field.rel.to in fileNames and field.rel.to is not info["model"]:
+                parents.add(fileNames[field.rel.to])
+        graph[info["fileName"]] = parents
+    return graph
+
+
+def importTask(zipPath, fileName, engine, batchSize):
+    start = time.time()
+    model = [info["model"] for info in modelMap if info["fileName"] == fileName][0]
+    try:
+        openedZipFile = zipfile.ZipFile(zipPath)
+        print "Importing file '%s' as %s" % (fileName, model._meta.verbose_name_plural.title())
+        with deferSignals():
+            loaded = engines[engine](openedZipFile.open(fileName), fileName, model, batchSize)
+        openedZipFile.close()
+    except Exception as e:
+        return fileName, time.time() - start, "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        db.connection.close()
+    if loaded is False:
+        return fileName, time.time() - start, "the file was rolled back"
+    return fileName, time.time() - start, None
+
+
+def importParallel(zipPath, engine, batchSize, jobs, timeout=taskTimeout):
+    """
+    Import the files on a pool of jobs processes, every file once the files
+    it references are loaded. Files that reference a failed file are
+    skipped, and a CommandError lists them once the other files are done.
+    """
+    graph = dependencies(modelMap)
+    done = set()
+    failed = set()
+    skipped = set()
+    running = set()
+    results = Queue.Queue()
+    # Every worker has to open its own connection instead of sharing the forked one.
+    for conn in db.connections.all():
+        conn.close()
+    pool = multiprocessing.Pool(jobs)
+    start = time.time()
+
+    def submit():
+        # modelMap lists parents before their children, so one pass skips every descendant of a failed file.
+        for info in modelMap:
+            fileName = info["fileName"]
+            if fileName in done or fileName in failed or fileName in skipped or fileName in running:
+                continue
+            if graph[fileName] & (failed | skipped):
+                skipped.add(fileName)
+                print "Skipping '%s', it references %s." % (fileName, ", ".join("'%s'" % name for name in sorted(graph[fileName] & (failed | skipped))))
+            elif graph[fileName] <= done:
+                running.add(fileName)
+                pool.apply_async(importTask, (zipPath, fileName, engine, batchSize), callback=results.put)
+
+    submit()
+    while running:
+        try:
+            fileName, elapsed, error = results.get(timeout=timeout)
+        except Queue.Empty:
+            # A worker that dies never reports back, stop instead of waiting forever.
+            pool.terminate()
+            raise CommandError("No file finished within %ss, gave up on %s." % (timeout, ", ".join("'%s'" % name for name in sorted(running))))
+        running.remove(fileName)
+        if error:
+            failed.add(fileName)
+            print "Import of '%s' failed: %s" % (fileName, error)
+        else:
+            done.add(fileName)
+        print "Finished '%s' in %.2fs (%.2fs since start)." % (fileName, elapsed, time.time() - start)
+        submit()
+    pool.close()
+    pool.join()
+    print "Imported %s files with %s jobs in %.2fs." % (len(done), jobs, time.time() - start)
+    if failed or skipped:
+        raise CommandError("Import of %s failed, skipped %s." % (", ".join("'%s'" % name for name in sorted(failed)),
+                                                                 ", ".join("'%s'" % name for name in sorted(skipped)) or "nothing"))
+
+
+def dropIndexes(models):
+    """
+    Drop the composite (index_together) indexes, the unique and foreign key
+    indexes stay since the upsert engine and the constraints need them.
+    Plain DROP INDEX statements, alter_index_together remakes the whole
+    table on SQLite.
+    """
+    with connection.schema_editor() as editor:
+        for model in models:
+            for fields in model._meta.index_together:
+                columns = [model._meta.get_field(field).column for field in fields]
+                for name in editor._constraint_names(model, columns, index=True, unique=False):
+                    editor.execute(editor._delete_constraint_sql(editor.sql_delete_index, model, name))
+
+
+def createIndexes(models):
+    with connection.schema_editor() as editor:
+        for model in models:
+            for fields in model._meta.index_together:
+                editor.execute(editor._create_index_sql(model, [model._meta.get_field(field) for field in fields], suffix="_idx"))
+
+
+def recordDatasetVersion(release, path, fileMap):
+    """
+    Write a DatasetVersion with the row count of every table in fileMap and
+    the CRC-32 of the files it was loaded from, as stored in the zip.
+    """
+    openedZipFile = zipfile.ZipFile(path)
+    names = set(openedZipFile.namelist())
+    tables = {}
+    for info in fileMap:
+        if info["fileName"] not in names:
+            continue
+        model = info.get("target", info["model"])
+        table = tables.setdefault(model._meta.db_table, {"rows": model.objects.count(), "files": {}})
+        table["files"][info["fileName"]] = "%08x" % (openedZipFile.getinfo(info["fileName"]).CRC & 0xffffffff)
+    openedZipFile.close()
+    DatasetVersion.objects.create(release=release, tables=json.dumps(tables, sort_keys=True))
+    bumpDataVersion()
+
+
+def rebuildDerived():
+    """
+    Rebuild everything that is derived from the imported tables, after
+    import_r27 and import_sr_delta.
+    """
+    start = time.time()
+    print "Building food documents."
+    print "Built %s food documents in %.2fs." % (buildDocuments(), time.time() - start)
+    start = time.time()
+    print "Ranked %s nutrient values in %.2fs." % (buildRankings(), time.time() - start)
+    start = time.time()
+    if buildSearchIndex():
+        print "Built the food search index in %.2fs." % (time.time() - start)
+    resetIndex()
+    if buildMatrix:
+        start = time.time()
+        matrix = buildMatrix()
+        print "Built the nutrient matrix in %.2fs." % (time.time() - start)
+        start = time.time()
+        buildSimilarityIndex(matrix)
+        print "Built the similarity index in %.2fs." % (time.time() - start)
+
+
 class Command(BaseCommand):
     args = "<zipFile>"
     help = 'Import the nutrition database (Only R27 Supported)'
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", dest="batchSize", type="int", default=chunkSize,
+                    help="Number of rows to send to the database per bulk insert."),
+        make_option("--engine", dest="engine", type="choice", choices=sorted(engines.keys()), default="orm",
+                    help="'orm' uses bulk_create, 'copy' loads the raw rows with COPY (PostgreSQL) or executemany, 'upsert' updates rows that already exist."),
+        make_option("--jobs", dest="jobs", type="int", default=1,
+                    help="Number of files to import concurrently, files are started once the tables they reference are loaded."),
+        make_option("--timeout", dest="timeout", type="int", default=taskTimeout,
+                    help="Seconds to wait for the next file to finish with --jobs, the import is aborted when none does."),
+        make_option("--preprocessed", dest="preprocessed",
+                    help="File with the decoded rows of the zip, written when missing or out of date and bulk loaded instead of parsing the zip."),
+        make_option("--defer-indexes", dest="deferIndexes", action="store_true", default=False,
+                    help="Drop the composite indexes before loading the files and build them once afterwards."),
+        make_option("--release", dest="release", default="SR27",
+                    help="Release recorded in the dataset version of this import."),
+    )
 
     def handle(self, *args, **options):
-        openedZipFile = zipfile.ZipFile(args[0])
-        order = 0
-        for info in modelMap:
-            print "Importing file '%s' as %s" % (info["fileName"], info["model"]._meta.verbose_name_plural.title())
-            importFile(openedZipFile.open(info["fileName"]), info["model"])
-        openedZipFile.close()
+        if not args:
+            raise CommandError("Usage: import_r27 %s" % self.args)
+        if options["jobs"] > 1 and connection.vendor == "sqlite":
+            print "SQLite does not support concurrent writers, importing with 1 job."
+            options["jobs"] = 1
+        deferred = [info["model"] for info in modelMap if info["model"]._meta.index_together] if options["deferIndexes"] else []
+        if deferred:
+            print "Dropping the composite indexes of %s." % ", ".join(model._meta.db_table for model in deferred)
+            dropIndexes(deferred)
+        try:
+            if options["preprocessed"]:
+                header = preprocessedHeader(options["preprocessed"])
+                if header != {"format": preprocessedFormat, "checksum": zipChecksum(args[0])}:
+                    start = time.time()
+                    print "Preprocessing '%s' into '%s'." % (args[0], options["preprocessed"])
+                    writePreprocessed(args[0], options["preprocessed"], options["batchSize"])
+                    print "Preprocessed the zip in %.2fs." % (time.time() - start)
+                loadPreprocessed(options["preprocessed"])
+            elif options["jobs"] > 1:
+                importParallel(args[0], options["engine"], options["batchSize"], options["jobs"], options["timeout"])
+            else:
+                openedZipFile = zipfile.ZipFile(args[0])
+                order = 0
+                with deferSignals():
+                    for info in modelMap:
+                        print "Importing file '%s' as %s" % (info["fileName"], info["model"]._meta.verbose_name_plural.title())
+                        engines[options["engine"]](openedZipFile.open(info["fileName"]), info["fileName"], info["model"], options["batchSize"])
+                openedZipFile.close()
+        finally:
+            if deferred:
+                start = time.time()
+                createIndexes(deferred)
+                print "Built the composite indexes in %.2fs." % (time.time() - start)
+        rebuildDerived()
+        recordDatasetVersion(options["release"], args[0], modelMap)
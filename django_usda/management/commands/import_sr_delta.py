@@ -0,0 +1,169 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from django_usda.models import Food, FoodLanguaLFactor, NutrientData, Nutrient, Weight, Footnote, DeletedFood, DeletedNutrient, DeletedFootnote
+from django_usda.management.commands.import_r27 import upsertLookupSize, fieldPlan, readRows, existingRows, upsertBatch, recordDatasetVersion
+from django_usda.signals import deferSignals
+from django_usda.documents import refreshDocuments, referencingFoods
+from django_usda.rankings import buildRankings, updateFoodGroups, nutrientsOf, ENERGY
+from django_usda.search import refreshSearchIndex
+try:
+    from django_usda.matrix import updateMatrix
+    from django_usda.similarity import buildSimilarityIndex
+except ImportError:
+    updateMatrix = None
+from django.db import transaction
+from django import db
+import zipfile
+import time
+import os
+
+# Files are applied in this order: new and changed parents before their
+# children, deletions last. Files missing from the zip are skipped.
+deltaMap = [
+    {"fileName": "ADD_NDEF.txt",	"model": Nutrient,			"keys": ("id",)},
+    {"fileName": "CHG_NDEF.txt",	"model": Nutrient,			"keys": ("id",)},
+    {"fileName": "ADD_FOOD.txt",	"model": Food,				"keys": ("id",)},
+    {"fileName": "CHG_FOOD.txt",	"model": Food,				"keys": ("id",)},
+    {"fileName": "ADD_NUTR.txt",	"model": NutrientData,		"keys": ("food_id", "nutrient_id")},
+    {"fileName": "CHG_NUTR.txt",	"model": NutrientData,		"keys": ("food_id", "nutrient_id")},
+    {"fileName": "ADD_WGT.txt",		"model": Weight,			"keys": ("food_id", "sequence")},
+    {"fileName": "CHG_WGT.txt",		"model": Weight,			"keys": ("food_id", "sequence")},
+    {"fileName": "ADD_FTNT.txt",	"model": Footnote,			"keys": ("food_id", "sequence", "nutrient_id")},
+    {"fileName": "ADD_LANG.txt",	"model": FoodLanguaLFactor,	"keys": ("food_id", "langual_factor_id")},
+    {"fileName": "DEL_FTNT.txt",	"model": DeletedFootnote,	"target": Footnote,		"keys": ("food_id", "sequence", "type")},
+    {"fileName": "DEL_NUTR.txt",	"model": DeletedNutrient,	"target": NutrientData,	"keys": ("food_id", "nutrient_id")},
+    {"fileName": "DEL_WGT.txt",		"model": Weight,			"target": Weight,		"keys": ("food_id", "sequence")},
+    {"fileName": "DEL_FOOD.txt",	"model": DeletedFood,		"target": Food,			"keys": ("food_id",), "targetKeys": ("id",)},
+]
+
+
+def newChanges():
+    """
+    What a delta touched: the foods with changed rows, the foods whose own
+    row changed, the foods whose energy changed, the nutrients with changed
+    values and the changed nutrient definitions.
+    """
+    return {"foods": set(), "foodRows": set(), "energy": set(), "nutrients": set(), "definitions": set()}
+
+
+def recordChanges(model, batch, changes):
+    for row in batch:
+        if model is Nutrient:
+            changes["definitions"].add(row["id"])
+        elif model is Food:
+            changes["foods"].add(row["id"])
+            changes["foodRows"].add(row["id"])
+        else:
+            changes["foods"].add(row["food_id"])
+        if model in (NutrientData, DeletedNutrient):
+            changes["nutrients"].add(row["nutrient_id"])
+            if row["nutrient_id"] == ENERGY:
+                changes["energy"].add(row["food_id"])
+        elif model is DeletedFood:
+            changes["foodRows"].add(row["food_id"])
+    if model is DeletedFood:
+        # The values of deleted foods drop out of the rankings of their nutrients.
+        changes["nutrients"].update(nutrientsOf(set(row["food_id"] for row in batch)))
+
+
+def refreshDerived(changes):
+    """
+    Refresh what is derived from the rows the delta touched, instead of
+    rebuilding everything like import_r27 does.
+    """
+    start = time.time()
+    foods = set(changes["foods"])
+    for nutrient in changes["definitions"]:
+        foods.update(referencingFoods[Nutrient](nutrient))
+    refreshDocuments(foods)
+    print "Refreshed %s food documents in %.2fs." % (len(foods), time.time() - start)
+    start = time.time()
+    updateFoodGroups(changes["foodRows"])
+    # The calorie basis divides by the energy, a changed energy moves every nutrient of the food.
+    nutrients = changes["nutrients"] | nutrientsOf(changes["energy"])
+    print "Ranked %s nutrient values of %s nutrients in %.2fs." % (buildRankings(nutrients=nutrients), len(nutrients), time.time() - start)
+    start = time.time()
+    if refreshSearchIndex(changes["foodRows"]):
+        print "Refreshed the food search index in %.2fs." % (time.time() - start)
+    if updateMatrix:
+        start = time.time()
+        matrix = updateMatrix(changes["foods"])
+        print "Updated the nutrient matrix in %.2fs." % (time.time() - start)
+        start = time.time()
+        buildSimilarityIndex(matrix)
+        print "Built the similarity index in %.2fs." % (time.time() - start)
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def deleteBatch(model, target, keys, targetKeys, batch, counts):
+    existing = existingRows(target, keys, targetKeys, batch, targetKeys)
+    pks = [existing[key]["pk"] for key in set(tuple(row[key] for key in keys) for row in batch) if key in existing]
+    target.objects.filter(pk__in=pks).delete()
+    counts["deleted"] += len(pks)
+    if model is not target:
+        # Record every deletion once, also when the same release is applied again.
+        recorded = existingRows(model, keys, keys, batch, keys)
+        created = {}
+        for row in batch:
+            key = tuple(row[name] for name in keys)
+            if key not in recorded and key not in created:
+                created[key] = model(**row)
+        model.objects.bulk_create(created.values())
+
+
+def applyFile(file, info, batchSize, changes):
+    model = info["model"]
+    target = info.get("target")
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0, "deleted": 0}
+    plan = fieldPlan(model)
+    if target is model:
+        # Only the keys of the rows to delete are needed.
+        plan = [(field, key, fieldType) for field, key, fieldType in plan if key in info["keys"]]
+    start = time.time()
+    for batch in batches(readRows(file, info["fileName"], plan, counts), batchSize):
+        recordChanges(model, batch, changes)
+        with transaction.atomic():
+            if target:
+                deleteBatch(model, target, info["keys"], info.get("targetKeys", info["keys"]), batch, counts)
+            else:
+                upsertBatch(model, info["keys"], batch, counts)
+        db.reset_queries()
+    print "Inserted %(inserted)s, updated %(updated)s, left %(unchanged)s unchanged, rejected %(rejected)s and deleted %(deleted)s rows" % counts,
+    print "in %.2fs." % (time.time() - start)
+
+
+class Command(BaseCommand):
+    args = "<zipFile>"
+    help = 'Apply an SR update release (ADD_*, CHG_* and DEL_* files) to the imported nutrition database'
+    option_list = BaseCommand.option_list + (
+        make_option("--batch-size", dest="batchSize", type="int", default=upsertLookupSize,
+                    help="Number of changed rows to apply per transaction."),
+        make_option("--release", dest="release",
+                    help="Release recorded in the dataset version, the name of the zip file by default."),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Usage: import_sr_delta %s" % self.args)
+        openedZipFile = zipfile.ZipFile(args[0])
+        names = set(openedZipFile.namelist())
+        changes = newChanges()
+        with deferSignals():
+            for info in deltaMap:
+                if info["fileName"] not in names:
+                    continue
+                print "Applying file '%s' to %s" % (info["fileName"], info.get("target", info["model"])._meta.verbose_name_plural.title())
+                applyFile(openedZipFile.open(info["fileName"]), info, options["batchSize"], changes)
+        openedZipFile.close()
+        refreshDerived(changes)
+        recordDatasetVersion(options["release"] or os.path.splitext(os.path.basename(args[0]))[0], args[0], deltaMap)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from django_usda.cache import touchDataVersion
+from django_usda.rankings import buildRankings
+import time
+
+chunkSize = 5000
+
+
+class Command(BaseCommand):
+    help = 'Recompute the derived Food and NutrientData scores from the nutrient matrix'
+    option_list = BaseCommand.option_list + (
+        make_option("--only-changed", dest="onlyChanged", action="store_true", default=False,
+                    help="Only write the scores of foods whose nutrient data changed since the last run."),
+        make_option("--batch-size", dest="batchSize", type="int", default=chunkSize,
+                    help="Number of rows to send to the database per executemany."),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from django_usda.matrix import buildMatrix
+            from django_usda.scores import writeScores, fingerprints, loadFingerprints, saveFingerprints
+        except ImportError:
+            raise CommandError("recompute_scores requires NumPy, install django_usda[matrix].")
+        start = time.time()
+        matrix = buildMatrix()
+        print "Built the nutrient matrix of %s foods in %.2fs." % (len(matrix.foods), time.time() - start)
+        prints = fingerprints(matrix)
+        foodIds = list(matrix.foods)
+        if options["onlyChanged"]:
+            previous = loadFingerprints()
+            foodIds = [foodId for foodId in foodIds if previous.get(foodId) != prints[foodId]]
+            print "%s foods changed since the last run." % len(foodIds)
+        start = time.time()
+        foods, ranked, nutrientDatas = writeScores(matrix, foodIds, options["batchSize"])
+        saveFingerprints(prints)
+        print "Updated the scores of %s foods, the ranks of %s foods and %s nutrient values in %.2fs." % (foods, ranked, nutrientDatas, time.time() - start)
+        # The top foods per nutrient are ranked on the same nutrient values as the matrix.
+        start = time.time()
+        print "Ranked %s nutrient values in %.2fs." % (buildRankings(), time.time() - start)
+        touchDataVersion()
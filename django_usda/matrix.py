@@ -0,0 +1,154 @@
+from django.conf import settings
+from threading import Lock
+from .models import Food, Nutrient, NutrientData
+import numpy as np
+import tempfile
+import os
+
+# Directory of the on-disk matrix, regenerated by import_r27.
+matrixDirectory = getattr(settings, "USDA_MATRIX_DIR", os.path.join(tempfile.gettempdir(), "django_usda_matrix"))
+matrixFiles = ("foods", "nutrients", "values")
+# Kept small so the IN lists stay below the SQLite variable limit.
+foodBatchSize = 500
+lock = Lock()
+loaded = {}
+
+
+class NutrientMatrix(object):
+    """
+    Dense float32 (food x nutrient) array of NutrientData.ounce, the amount
+    per 100 grams. Missing values are 0.
+    """
+
+    def __init__(self, foods, nutrients, values):
+        self.foods = foods
+        self.nutrients = nutrients
+        self.values = values
+        self.foodIndex = dict((foodId, row) for row, foodId in enumerate(foods))
+        self.nutrientIndex = dict((nutrientId, column) for column, nutrientId in enumerate(nutrients))
+
+    @classmethod
+    def fromDatabase(cls):
+        foods = np.array(list(Food.objects.order_by("pk").values_list("pk", flat=True)), dtype=np.unicode_)
+        nutrients = np.array(list(Nutrient.objects.order_by("pk").values_list("pk", flat=True)), dtype=np.unicode_)
+        matrix = cls(foods, nutrients, np.zeros((len(foods), len(nutrients)), dtype=np.float32))
+        rows = NutrientData.objects.values_list("food_id", "nutrient_id", "ounce").iterator()
+        for foodId, nutrientId, ounce in rows:
+            if ounce is not None:
+                matrix.values[matrix.foodIndex[foodId], matrix.nutrientIndex[nutrientId]] = ounce
+        return matrix
+
+    def reload(self, foodIds):
+        """
+        Read the values of the foods from the database again.
+        """
+        foodIds = sorted(set(foodIds) & set(self.foodIndex))
+        self.values[self.rows(foodIds)] = 0
+        for start in xrange(0, len(foodIds), foodBatchSize):
+            rows = NutrientData.objects.filter(food__in=foodIds[start:start + foodBatchSize]).values_list("food_id", "nutrient_id", "ounce")
+            for foodId, nutrientId, ounce in rows:
+                if ounce is not None:
+                    self.values[self.foodIndex[foodId], self.nutrientIndex[nutrientId]] = ounce
+
+    @classmethod
+    def load(cls, directory=matrixDirectory):
+        arrays = [np.load(os.path.join(directory, "%s.npy" % name), mmap_mode="r") for name in matrixFiles]
+        return cls(*arrays)
+
+    def save(self, directory=matrixDirectory):
+        # Write next to the old files and rename, so readers never see half a matrix.
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, array in zip(matrixFiles, (self.foods, self.nutrients, self.values)):
+            path = os.path.join(directory, "%s.npy" % name)
+            with open(path + ".tmp", "wb") as file:
+                np.save(file, array)
+            os.rename(path + ".tmp", path)
+
+    def rows(self, foodIds):
+        return np.array([self.foodIndex[foodId] for foodId in foodIds], dtype=np.intp)
+
+    def columns(self, nutrientIds):
+        return self.values[:, [self.nutrientIndex[nutrientId] for nutrientId in nutrientIds]]
+
+    def column(self, nutrientId):
+        return self.values[:, self.nutrientIndex[nutrientId]]
+
+    def scaled(self, grams, rows=None):
+        """
+        Nutrient amounts for the given gram weights, one weight per food or a single weight for all.
+        """
+        values = self.values if rows is None else self.values[rows]
+        return values * (np.asarray(grams, dtype=np.float32).reshape(-1, 1) / 100)
+
+    def top(self, scores, k, rows=None):
+        """
+        The k (food id, score) pairs with the highest scores. When rows is
+        given, scores holds one score per row instead of one per food.
+        """
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="mergesort")]
+        foods = self.foods if rows is None else self.foods[rows]
+        return [(foods[i], float(scores[i])) for i in best]
+
+    def topForNutrient(self, nutrientId, k, rows=None):
+        scores = self.column(nutrientId)
+        if rows is not None:
+            scores = scores[rows]
+        return self.top(scores, k, rows)
+
+
+def filteredRows(matrix, foodGroup=None, tags=None):
+    """
+    Rows of the foods in foodGroup with any of tags, None when there is no filter.
+    """
+    if not foodGroup and not tags:
+        return None
+    foods = Food.objects.all()
+    if foodGroup:
+        foods = foods.filter(food_group=foodGroup)
+    if tags:
+        foods = foods.filter(tags__name__in=tags)
+    return matrix.rows(set(foods.values_list("pk", flat=True)) & set(matrix.foodIndex))
+
+
+def buildMatrix(directory=matrixDirectory):
+    matrix = NutrientMatrix.fromDatabase()
+    matrix.save(directory)
+    return matrix
+
+
+def updateMatrix(foodIds, directory=matrixDirectory):
+    """
+    Reload the rows of the foods in the saved matrix, after their nutrient
+    values changed. The whole matrix is built again when foods or nutrients
+    were added or deleted, or when there is none yet.
+    """
+    if not os.path.exists(os.path.join(directory, "values.npy")):
+        return buildMatrix(directory)
+    saved = NutrientMatrix.load(directory)
+    if (list(saved.foods) != list(Food.objects.order_by("pk").values_list("pk", flat=True)) or
+            list(saved.nutrients) != list(Nutrient.objects.order_by("pk").values_list("pk", flat=True))):
+        return buildMatrix(directory)
+    matrix = NutrientMatrix(np.array(saved.foods), np.array(saved.nutrients), np.array(saved.values))
+    matrix.reload(foodIds)
+    matrix.save(directory)
+    return matrix
+
+
+def getMatrix(directory=matrixDirectory):
+    """
+    The memory-mapped matrix of this process, reloaded when import_r27 has written a new one.
+    """
+    path = os.path.join(directory, "values.npy")
+    with lock:
+        if not os.path.exists(path):
+            buildMatrix(directory)
+        modified = os.path.getmtime(path)
+        if loaded.get("modified") != modified:
+            loaded["matrix"] = NutrientMatrix.load(directory)
+            loaded["modified"] = modified
+        return loaded["matrix"]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_usda', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodDocument',
+            fields=[
+                ('food', models.OneToOneField(related_name='document', primary_key=True, serialize=False, to='django_usda.Food',
+                                              help_text='The food this document describes.')),
+                ('document', models.TextField(help_text='Pre-serialized JSON of the food together with all related information.',
+                                              verbose_name='Document')),
+            ],
+            options={
+                'verbose_name': 'Food document',
+                'verbose_name_plural': 'Food documents',
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_usda', '0002_fooddocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('release', models.CharField(help_text="SR release of the imported data, for example 'SR27'.", max_length=40,
+                                             verbose_name='Release')),
+                ('imported', models.DateTimeField(help_text='Time of the import.', verbose_name='Imported', auto_now_add=True)),
+                ('changed', models.DateTimeField(help_text='Time of the last change, by the import or through the API.',
+                                                 verbose_name='Changed', auto_now=True)),
+                ('tables', models.TextField(help_text='JSON of the row count and source file checksum of every table.',
+                                            verbose_name='Tables')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'verbose_name': 'Dataset version',
+                'verbose_name_plural': 'Dataset versions',
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_usda', '0003_datasetversion'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='food',
+            index_together=set([('food_group', 'long_description')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='nutrientdata',
+            index_together=set([('nutrient', 'ounce', 'food')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='footnote',
+            index_together=set([('food', 'nutrient')]),
+        ),
+    ]
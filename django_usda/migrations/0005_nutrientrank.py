@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_usda', '0004_index_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NutrientRank',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('basis', models.CharField(help_text='Whether the foods are ranked by weight or by calories.', max_length=7,
+                                           verbose_name='Basis', choices=[('weight', 'Amount per 100 grams'), ('calorie', 'Amount per 100 kcal')])),
+                ('rank', models.IntegerField(help_text='Position of the food, 1 has the most of the nutrient.', verbose_name='Rank')),
+                ('amount', models.FloatField(help_text='Amount of the nutrient per 100 grams or per 100 kcal.', verbose_name='Amount')),
+                ('food', models.ForeignKey(related_name='nutrient_ranks', to='django_usda.Food')),
+                ('food_group', models.ForeignKey(related_name='+', to='django_usda.FoodGroup',
+                                                 help_text='Food group of the food, to rank within a group.')),
+                ('nutrient', models.ForeignKey(related_name='ranks', to='django_usda.Nutrient', help_text='The ranked nutrient.')),
+            ],
+            options={
+                'ordering': ['rank'],
+                'verbose_name': 'Nutrient rank',
+                'verbose_name_plural': 'Nutrient ranks',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='nutrientrank',
+            index_together=set([('nutrient', 'basis', 'rank'), ('nutrient', 'basis', 'food_group', 'rank')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_usda', '0005_nutrientrank'),
+    ]
+
+    # A food can have several deleted nutrients and footnotes, so food_id is no
+    # longer the primary key. The existing rows are numbered by the new id column.
+    operations = [
+        migrations.AlterField(
+            model_name='deletednutrient',
+            name='food_id',
+            field=models.CharField(help_text='Unique 5-digit number identifying the item that contains the deleted nutrient record. ',
+                                   max_length=5, verbose_name='Nutrient Databank number', db_column=b'NDB_No'),
+        ),
+        migrations.AddField(
+            model_name='deletednutrient',
+            name='id',
+            field=models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deletednutrient',
+            unique_together=set([('food_id', 'nutrient_id')]),
+        ),
+        migrations.AlterField(
+            model_name='deletedfootnote',
+            name='food_id',
+            field=models.CharField(help_text='Unique 5-digit number identifying the item that contains the deleted nutrient record. ',
+                                   max_length=5, verbose_name='Nutrient Databank number', db_column=b'NDB_No'),
+        ),
+        migrations.AddField(
+            model_name='deletedfootnote',
+            name='id',
+            field=models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deletedfootnote',
+            unique_together=set([('food_id', 'sequence', 'type')]),
+        ),
+    ]
@@ -19,6 +19,7 @@ class Food(models.Model):
     class Meta:
         verbose_name = _('Fooddescription')
         verbose_name_plural = _('Fooddescriptions')
+        index_together = (("food_group", "long_description"),)
     id = models.CharField(_("Nutrient Databank number"), db_column="NDB_No", max_length=5, primary_key=True, help_text=_(
         "5-digit NutrientDatabank number that uniquelyidentifies a food item. If this field is defined asnumeric, the leading zero will be lost. "))
     food_group = models.ForeignKey('FoodGroup', db_column="FdGrp_Cd", help_text=_(
@@ -116,6 +117,8 @@ class NutrientData(models.Model):
         verbose_name = _('Nutrient Data')
         verbose_name_plural = _('Nutrient Datas')
         unique_together = ("food", "nutrient")
+        # Covers the "top foods for a nutrient" queries without reading the table.
+        index_together = (("nutrient", "ounce", "food"),)
     food = models.ForeignKey('Food', db_column="NDB_No",
                              help_text=_("5-digit Nutrient Databank number."), on_delete=models.CASCADE)
     nutrient = models.ForeignKey('Nutrient', db_column="Nutr_No", help_text=_(
@@ -255,6 +258,7 @@ class Footnote(models.Model):
         verbose_name = _('LanguaL factor')
         verbose_name_plural = _('LanguaL factors')
         ordering = ['name']
+        index_together = (("food", "nutrient"),)
     food = models.ForeignKey('Food', db_column="NDB_No",
                              help_text=_("5-digit Nutrient Databank number."), on_delete=models.CASCADE)
     sequence = models.CharField(_("Sequence"), db_column="Footnt_No", max_length=4, help_text=_(
@@ -359,7 +363,8 @@ class DeletedNutrient(models.Model):
         verbose_name = _('Deleted nutrient')
         verbose_name_plural = _('Deleted nutrients')
         ordering = ['nutrient_id']
-    food_id = models.CharField(_("Nutrient Databank number"), db_column="NDB_No", max_length=5, primary_key=True, help_text=_(
+        unique_together = ("food_id", "nutrient_id")
+    food_id = models.CharField(_("Nutrient Databank number"), db_column="NDB_No", max_length=5, help_text=_(
         "Unique 5-digit number identifying the item that contains the deleted nutrient record. "))
     nutrient_id = models.CharField(_("Nutrient ID"), db_column="Nutr_No",
                                    max_length=3, help_text=_("Nutrient number of deleted record. "))
@@ -377,7 +382,8 @@ class DeletedFootnote(models.Model):
     class Meta:
         verbose_name = _('LanguaL factor')
         verbose_name_plural = _('LanguaL factors')
-    food_id = models.CharField(_("Nutrient Databank number"), db_column="NDB_No", max_length=5, primary_key=True, help_text=_(
+        unique_together = ("food_id", "sequence", "type")
+    food_id = models.CharField(_("Nutrient Databank number"), db_column="NDB_No", max_length=5, help_text=_(
         "Unique 5-digit number identifying the item that contains the deleted nutrient record. "))
     sequence = models.CharField(
         _("Sequence"), db_column="Footnt_No", max_length=4)
@@ -386,3 +392,74 @@ class DeletedFootnote(models.Model):
 
     def __unicode__(self):
         return "%s - %s" % (self.food_id, self.sequence)
+
+
+# Denormalized food documents, rebuilt after every import
+# ////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ///////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+
+class FoodDocument(models.Model):
+
+    class Meta:
+        verbose_name = _('Food document')
+        verbose_name_plural = _('Food documents')
+    food = models.OneToOneField('Food', primary_key=True, related_name="document", help_text=_(
+        "The food this document describes."), on_delete=models.CASCADE)
+    document = models.TextField(_("Document"), help_text=_(
+        "Pre-serialized JSON of the food together with all related information."))
+
+    def __unicode__(self):
+        return unicode(self.food_id)
+
+
+# Dataset versions, one per import
+# ////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ///////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+
+class DatasetVersion(models.Model):
+
+    class Meta:
+        verbose_name = _('Dataset version')
+        verbose_name_plural = _('Dataset versions')
+        ordering = ['-id']
+    release = models.CharField(_("Release"), max_length=40, help_text=_(
+        "SR release of the imported data, for example 'SR27'."))
+    imported = models.DateTimeField(_("Imported"), auto_now_add=True, help_text=_("Time of the import."))
+    changed = models.DateTimeField(_("Changed"), auto_now=True, help_text=_(
+        "Time of the last change, by the import or through the API."))
+    tables = models.TextField(_("Tables"), help_text=_(
+        "JSON of the row count and source file checksum of every table."))
+
+    def __unicode__(self):
+        return "%s - %s" % (self.release, self.imported)
+
+
+# Nutrient rankings, rebuilt after every import
+# ////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+# ///////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+
+RANK_BASIS_CHOICES = (
+    ('weight', _('Amount per 100 grams')),
+    ('calorie', _('Amount per 100 kcal')),
+)
+
+
+class NutrientRank(models.Model):
+
+    class Meta:
+        verbose_name = _('Nutrient rank')
+        verbose_name_plural = _('Nutrient ranks')
+        ordering = ['rank']
+        index_together = (("nutrient", "basis", "rank"), ("nutrient", "basis", "food_group", "rank"))
+    nutrient = models.ForeignKey('Nutrient', related_name="ranks", help_text=_(
+        "The ranked nutrient."), on_delete=models.CASCADE)
+    basis = models.CharField(_("Basis"), max_length=7, choices=RANK_BASIS_CHOICES, help_text=_(
+        "Whether the foods are ranked by weight or by calories."))
+    rank = models.IntegerField(_("Rank"), help_text=_("Position of the food, 1 has the most of the nutrient."))
+    food = models.ForeignKey('Food', related_name="nutrient_ranks", on_delete=models.CASCADE)
+    food_group = models.ForeignKey('FoodGroup', related_name="+", help_text=_(
+        "Food group of the food, to rank within a group."), on_delete=models.CASCADE)
+    amount = models.FloatField(_("Amount"), help_text=_("Amount of the nutrient per 100 grams or per 100 kcal."))
+
+    def __unicode__(self):
+        return "%s - %s - %s" % (self.nutrient_id, self.basis, self.rank)
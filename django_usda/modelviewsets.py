@@ -1,210 +1,277 @@
-from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote
-from rest_framework import serializers, viewsets
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, DeletedFood, DeletedNutrient, DeletedFootnote, FoodDocument, NutrientRank, RANK_BASIS_CHOICES
+from rest_framework import viewsets, permissions
 from rest_framework import filters
-
-
-class NutrientDataSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = NutrientData
-        fields = ("food", "nutrient", "ounce", "data_points", "error", "data_type", "derivation", "food_reference", "added_nutrient", "studies", "minimum_value",
-                  "maximum_value", "degrees_of_freedom", "lower_error_bound", "uppper_error_bound", "statistical_comments", "last_modified", "confidence_code")
-
-
-class NutrientDataViewSet(viewsets.ModelViewSet):
+from rest_framework.decorators import list_route, detail_route
+from rest_framework.response import Response
+from rest_framework.exceptions import ParseError
+from .autocomplete import getIndex
+from .pagination import KeysetPagination, RankingPagination
+from .export import ExportMixin
+from .multiget import MultiGetMixin
+from .cache import ConditionalGetMixin, CachedReadMixin, cacheStats
+from .replica import ReplicaMixin, getReplica
+from .search import FoodSearchFilter, searchFields, searchBackend
+from .serializers import NutrientDataSerializer, FoodSerializer, FoodGroupSerializer, FoodLanguaLFactorSerializer, LanguaLFactorSerializer, NutrientSerializer, SourceSerializer, DerivationSerializer, WeightSerializer, FootnoteSerializer, DataSourceSerializer, DataLinkSerializer, FoodInfoSerializer, foodInfoPrefetch
+from django.http import HttpResponse, Http404
+
+
+maxIngredients = 500
+
+
+def ingredientGrams(ingredients):
+    if not isinstance(ingredients, list) or not 0 < len(ingredients) <= maxIngredients:
+        raise ParseError("ingredients must be a list of 1 to %s ingredients." % maxIngredients)
+    try:
+        foods = set(ingredient["food"] for ingredient in ingredients)
+    except (KeyError, TypeError):
+        raise ParseError("Every ingredient needs a food.")
+    replica = getReplica()
+    if replica is not None:
+        weights = replica.unitGrams(foods)
+    else:
+        weights = {}
+        for food, sequence, amount, grams in Weight.objects.filter(food__in=foods).values_list("food", "sequence", "amount", "grams"):
+            weights[(food, sequence)] = grams / amount if amount else grams
+    grams = {}
+    for ingredient in ingredients:
+        try:
+            amount = float(ingredient.get("amount", 1))
+            if "grams" in ingredient:
+                weight = float(ingredient["grams"])
+            else:
+                weight = weights[(ingredient["food"], str(ingredient["sequence"]))]
+        except (KeyError, TypeError, ValueError):
+            raise ParseError("Ingredient %s needs grams or the sequence of one of its weights." % ingredient["food"])
+        # float() also accepts "nan", "inf" and NaN from the JSON parser, which fail both comparisons.
+        if not 0 <= amount < float("inf") or not 0 <= weight < float("inf"):
+            raise ParseError("The amount and grams of ingredient %s must be finite and not negative." % ingredient["food"])
+        grams[ingredient["food"]] = grams.get(ingredient["food"], 0) + weight * amount
+    return grams
+
+
+def nutrientTotals(ingredients):
+    grams = ingredientGrams(ingredients)
+    replica = getReplica()
+    if replica is not None:
+        values = replica.nutrientValues(grams.keys())
+    else:
+        values = NutrientData.objects.filter(food__in=grams.keys()).values_list("food", "nutrient", "ounce")
+    totals = {}
+    for food, nutrient, ounce in values:
+        if ounce is not None:
+            totals[nutrient] = totals.get(nutrient, 0) + ounce * grams[food] / 100
+    if replica is not None:
+        nutrients = [replica.tables[Nutrient].get(nutrient) for nutrient in totals]
+    else:
+        nutrients = Nutrient.objects.filter(pk__in=totals.keys()).values("id", "name", "units", "order")
+    return {
+        "grams": sum(grams.values()),
+        "ingredients": [{"food": food, "grams": weight} for food, weight in sorted(grams.items())],
+        "nutrients": [{"nutrient": nutrient["id"], "name": nutrient["name"], "units": nutrient["units"], "amount": totals[nutrient["id"]]}
+                      for nutrient in sorted(nutrients, key=lambda nutrient: (nutrient["order"], nutrient["id"]))],
+    }
+
+
+class NutrientDataViewSet(ExportMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
+    keyset_fields = ("food", "nutrient")
     queryset = NutrientData.objects.all()
     serializer_class = NutrientDataSerializer
 
-
-class FoodSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Food
-        fields = ("id", "food_group", "long_description", "name", "manufacturer_name", "survey",
-                  "refuse_description", "refuse_percentage", "scientific_name", "n_factor", "pro_factor", "fat_factor", "cho_factor")
+    @list_route(methods=["post"], permission_classes=[permissions.AllowAny])
+    def totals(self, request):
+        """
+        Nutrient totals of a recipe or meal. Post {"ingredients": [...]} where every
+        ingredient is {"food": "01001", "sequence": "1", "amount": 2} (2 times Weight 1
+        of the food) or {"food": "01001", "grams": 150}. Reads nothing but this request.
+        """
+        if not isinstance(request.data, dict):
+            raise ParseError("Post an object with the ingredients.")
+        return Response(nutrientTotals(request.data.get("ingredients")))
 
 
-class FoodViewSet(viewsets.ModelViewSet):
+class FoodViewSet(ExportMixin, MultiGetMixin, ConditionalGetMixin, ReplicaMixin, viewsets.ModelViewSet):
     queryset = Food.objects.all()
     serializer_class = FoodSerializer
-    filter_backends = (filters.SearchFilter,)
-    filter_fields = ("id")
-    search_fields = (
-        "long_description", "name", "manufacturer_name")
-
-
-class FoodGroupSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = FoodGroup
-        fields = ("id", "name")
-
-
-class FoodGroupViewSet(viewsets.ModelViewSet):
+    filter_backends = (FoodSearchFilter,)
+    filter_fields = ("id",)
+    search_fields = searchFields
+
+    def list(self, request, *args, **kwargs):
+        response = super(FoodViewSet, self).list(request, *args, **kwargs)
+        # The facets search again, so only on request and only on the full text index.
+        if request.GET.get("search") and request.GET.get("facets") in ("1", "true") and searchBackend() is not None and isinstance(response.data, dict):
+            response.data["facets"] = FoodSearchFilter().facets(request, self.get_queryset(), self)
+        return response
+
+    @list_route(methods=["get"])
+    def autocomplete(self, request):
+        """
+        Top matches for ?q= from the in-memory autocomplete index, ?limit= (at most 50) of them.
+        """
+        try:
+            limit = min(int(request.GET.get("limit", 10)), 50)
+        except ValueError:
+            limit = 10
+        return Response(getIndex().complete(request.GET.get("q", ""), limit))
+
+    @list_route(methods=["get"])
+    def optimise(self, request):
+        """
+        Foods ranked against a target profile, scored over the cached nutrient matrix.
+        ?nutrients=203:2,301:1 weights nutrients (default: all with a target once),
+        ?variant= picks the targets (rdi, male, female, pregnant, breast, kg, 75, 100, oni_male, oni_female),
+        ?body_weight= is required for kg, ?basis=calorie scores per 2000 kcal instead of per 100 grams,
+        ?food_group=, ?tags=a,b and ?limit= (at most 250) narrow the results.
+        """
+        from .optimiser import optimise, variants
+        try:
+            weights = dict((nutrient, float(weight)) for nutrient, weight in (
+                item.split(":") for item in request.GET.get("nutrients", "").split(",") if item))
+            limit = min(int(request.GET.get("limit", 50)), 250)
+            bodyWeight = float(request.GET["body_weight"]) if "body_weight" in request.GET else None
+        except ValueError:
+            raise ParseError("nutrients must look like 203:2,301:1, limit and body_weight must be numbers.")
+        variant = request.GET.get("variant", "rdi")
+        if variant not in variants or (variant == "kg" and bodyWeight is None):
+            raise ParseError("Unknown variant, or kg without body_weight.")
+        if bodyWeight is not None and not 0 < bodyWeight < float("inf"):
+            raise ParseError("body_weight must be a positive number.")
+        basis = request.GET.get("basis", "weight")
+        if basis not in dict(RANK_BASIS_CHOICES):
+            raise ParseError("basis must be weight or calorie.")
+        tags = [tag for tag in request.GET.get("tags", "").split(",") if tag]
+        ranked = optimise(weights, variant, basis, bodyWeight, request.GET.get("food_group"), tags, limit)
+        names = dict(Food.objects.filter(pk__in=[foodId for foodId, score in ranked]).values_list("pk", "long_description"))
+        return Response([{"id": foodId, "long_description": names.get(foodId), "score": score} for foodId, score in ranked])
+
+    @detail_route(methods=["get"])
+    def similar(self, request, pk=None):
+        """
+        The ?limit= (at most 100) foods with the nutrient profile closest to this food
+        by cosine distance, optionally within ?food_group= or ?tags=a,b.
+        """
+        from .similarity import similarFoods
+        try:
+            limit = min(int(request.GET.get("limit", 10)), 100)
+        except ValueError:
+            raise ParseError("limit must be a number.")
+        tags = [tag for tag in request.GET.get("tags", "").split(",") if tag]
+        try:
+            similar = similarFoods(pk, limit, request.GET.get("food_group"), tags)
+        except KeyError:
+            raise Http404
+        names = dict(Food.objects.filter(pk__in=[foodId for foodId, score in similar]).values_list("pk", "long_description"))
+        return Response([{"id": foodId, "long_description": names.get(foodId), "distance": 1 - score} for foodId, score in similar])
+
+
+class FoodGroupViewSet(ExportMixin, CachedReadMixin, ReplicaMixin, viewsets.ModelViewSet):
     queryset = FoodGroup.objects.all()
     serializer_class = FoodGroupSerializer
 
 
-class FoodLanguaLFactorSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = FoodLanguaLFactor
-        fields = ("food", "langual_factor")
-
-
-class FoodLanguaLFactorViewSet(viewsets.ModelViewSet):
+class FoodLanguaLFactorViewSet(ExportMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
+    keyset_fields = ("food", "langual_factor")
     filter_fields = ("food", "langual_factor")
     queryset = FoodLanguaLFactor.objects.all()
     serializer_class = FoodLanguaLFactorSerializer
 
 
-class LanguaLFactorSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = LanguaLFactor
-        fields = ("id", "name")
-
-
-class LanguaLFactorViewSet(viewsets.ModelViewSet):
-    filter_fields = ("id")
+class LanguaLFactorViewSet(ExportMixin, CachedReadMixin, ReplicaMixin, viewsets.ModelViewSet):
+    filter_fields = ("id",)
     queryset = LanguaLFactor.objects.all()
     serializer_class = LanguaLFactorSerializer
 
 
-class NutrientSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Nutrient
-        fields = ("id", "units", "tagname", "name", "decimals", "order")
-
-
-class NutrientViewSet(viewsets.ModelViewSet):
-    filter_fields = ("id")
+class NutrientViewSet(ExportMixin, CachedReadMixin, ReplicaMixin, viewsets.ModelViewSet):
+    filter_fields = ("id",)
     queryset = Nutrient.objects.all()
     serializer_class = NutrientSerializer
 
-
-class SourceSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Source
-        fields = ("id", "name")
-
-
-class SourceViewSet(viewsets.ModelViewSet):
+    @detail_route()
+    def top(self, request, pk=None):
+        """
+        The foods with the most of this nutrient, ?basis=weight (per 100 g, the
+        default) or calorie (per 100 kcal), within one ?food_group= if given.
+        """
+        return self.cached(request, self.ranking, pk=pk)
+
+    def ranking(self, request, pk=None):
+        nutrient = self.get_object()
+        basis = request.GET.get("basis", "weight")
+        if basis not in dict(RANK_BASIS_CHOICES):
+            raise ParseError("basis must be weight or calorie.")
+        ranks = NutrientRank.objects.filter(nutrient=nutrient, basis=basis)
+        if request.GET.get("food_group"):
+            ranks = ranks.filter(food_group=request.GET["food_group"])
+        ranks = ranks.order_by("rank").values("rank", "food", "food__long_description", "food_group", "amount")
+        paginator = RankingPagination()
+        page = paginator.paginate_queryset(ranks, request, view=self)
+        return paginator.get_paginated_response([{"rank": rank["rank"], "food": rank["food"], "long_description": rank["food__long_description"],
+                                                  "food_group": rank["food_group"], "amount": rank["amount"]} for rank in page])
+
+
+class SourceViewSet(ExportMixin, CachedReadMixin, ReplicaMixin, viewsets.ModelViewSet):
     queryset = Source.objects.all()
     serializer_class = SourceSerializer
 
 
-class DerivationSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Derivation
-        fields = ("id", "name")
-
-
-class DerivationViewSet(viewsets.ModelViewSet):
+class DerivationViewSet(ExportMixin, CachedReadMixin, ReplicaMixin, viewsets.ModelViewSet):
     queryset = Derivation.objects.all()
     serializer_class = DerivationSerializer
 
 
-class WeightSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Weight
-        fields = ("food", "sequence", "amount", "name",
-                  "grams", "data_points", "standard_derivation")
-
-
-class WeightViewSet(viewsets.ModelViewSet):
-    filter_fields = ("food")
+class WeightViewSet(ExportMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    filter_fields = ("food",)
     queryset = Weight.objects.all()
     serializer_class = WeightSerializer
 
 
-class FootnoteSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Footnote
-        fields = ("food", "sequence", "type", "nutrient", "name")
-
-
-class FootnoteViewSet(viewsets.ModelViewSet):
+class FootnoteViewSet(ExportMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Footnote.objects.all()
     serializer_class = FootnoteSerializer
 
 
-class DataSourceSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = DataSource
-        fields = ("id", "authors", "name", "year", "journal",
-                  "volume", "issue_state", "start_page", "end_page")
-
-
-class DataSourceViewSet(viewsets.ModelViewSet):
+class DataSourceViewSet(ExportMixin, ConditionalGetMixin, ReplicaMixin, viewsets.ModelViewSet):
     filter_fields = ("id", "year")
     queryset = DataSource.objects.all()
     serializer_class = DataSourceSerializer
 
 
-class DataLinkSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = DataLink
-        fields = ("food", "nutrient", "data_source")
-
-
-class DataLinkViewSet(viewsets.ModelViewSet):
+class DataLinkViewSet(ExportMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
+    keyset_fields = ("food", "nutrient", "data_source")
     filter_fields = ("food", "nutrient", "data_source")
     queryset = DataLink.objects.all()
     serializer_class = DataLinkSerializer
 
-# The view and serializers to get all related Food information.
-
-
-class FoodLanguaLFactorInfoSerializer(serializers.ModelSerializer):
-    langual_factor = LanguaLFactorSerializer()
-
-    class Meta:
-        model = FoodLanguaLFactor
-        fields = ("langual_factor",)
-
-
-class DataLinkInfoSerializer(serializers.ModelSerializer):
-    data_source = DataSourceSerializer()
+# The view to get all related Food information.
 
-    class Meta:
-        model = DataLink
-        fields = ("data_source",)
 
+class FoodInfoViewSet(ExportMixin, MultiGetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Food.objects.select_related("food_group").prefetch_related(*foodInfoPrefetch)
+    serializer_class = FoodInfoSerializer
+    filter_fields = ("id",)
 
-class NutrientDataInfoSerializer(serializers.ModelSerializer):
-    nutrient = NutrientSerializer()
-    derivation = DerivationSerializer()
-    datatype = SourceSerializer()
-
-    class Meta:
-        model = NutrientData
-        fields = ("nutrient", "ounce", "data_points", "error", "data_type", "derivation", "food_reference", "added_nutrient", "studies", "minimum_value",
-                  "maximum_value", "degrees_of_freedom", "lower_error_bound", "uppper_error_bound", "statistical_comments", "last_modified", "confidence_code")
 
+class FoodDocumentViewSet(ExportMixin, ConditionalGetMixin, viewsets.GenericViewSet):
+    """
+    Serves the pre-serialized documents built by import_r27 without running a serializer.
+    """
+    queryset = FoodDocument.objects.all()
 
-class FoodInfoSerializer(serializers.ModelSerializer):
-    food_group = FoodGroupSerializer()
-    footnote_set = FootnoteSerializer()
-    nutrientdata_set = NutrientDataInfoSerializer()
-    weight_set = WeightSerializer()
-    foodlangualfactor_set = FoodLanguaLFactorInfoSerializer()
-    datalink_set = DataLinkInfoSerializer()
+    def retrieve(self, request, pk=None):
+        document = FoodDocument.objects.filter(pk=pk).values_list("document", flat=True).first()
+        if document is None:
+            raise Http404
+        return HttpResponse(document, content_type="application/json")
 
-    class Meta:
-        model = Food
-        fields = ("id", "food_group", "long_description", "name", "manufacturer_name", "survey", "refuse_description", "refuse_percentage",
-                  "scientific_name", "n_factor", "pro_factor", "fat_factor", "cho_factor", 'footnote_set', 'nutrientdata_set', 'weight_set', 'foodlangualfactor_set', 'datalink_set')
 
+class CacheStatsViewSet(viewsets.ViewSet):
+    """
+    Hit and miss counters of the reference table cache of this process.
+    """
 
-class FoodInfoViewSet(viewsets.ModelViewSet):
-    queryset = Food.objects.all()
-    serializer_class = FoodInfoSerializer
-    filter_fields = ("id",)
+    def list(self, request):
+        return Response(cacheStats())
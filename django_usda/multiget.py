@@ -0,0 +1,24 @@
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+
+# The ids go into one IN list, which stays below the SQLite variable limit.
+maxBatchIds = 100
+
+
+class MultiGetMixin(object):
+    """
+    Several objects in one request from /<endpoint>/batch/?ids=01001,01002, in
+    the order of the ids. Unknown ids are left out.
+    """
+
+    @list_route(methods=["get"])
+    def batch(self, request):
+        ids = []
+        for pk in request.GET.get("ids", "").split(","):
+            if pk and pk not in ids:
+                ids.append(pk)
+        if not 0 < len(ids) <= maxBatchIds:
+            raise ParseError("ids must list 1 to %s ids, separated by commas." % maxBatchIds)
+        objects = dict((obj.pk, obj) for obj in self.get_queryset().filter(pk__in=ids))
+        return Response(self.get_serializer([objects[pk] for pk in ids if pk in objects], many=True).data)
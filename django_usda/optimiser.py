@@ -0,0 +1,63 @@
+from .models import Nutrient
+from .matrix import matrixDirectory, getMatrix, filteredRows
+from .scores import ENERGY, densityCap, referenceCalories
+from .cache import dataVersion
+import numpy as np
+
+# Target profiles, as Nutrient fields. "kg" targets are per kilogram of body weight.
+variants = {
+    "rdi": "rdi",
+    "male": "rdi_male",
+    "female": "rdi_female",
+    "pregnant": "rdi_pregnant",
+    "breast": "rdi_breast",
+    "kg": "rdi_kg",
+    "75": "rdi_75",
+    "100": "rdi_100",
+    "oni_male": "oni_male",
+    "oni_female": "oni_female",
+}
+targetCache = {}
+
+
+def targetVector(matrix, variant):
+    # The targets are edited through the admin or the ORM, which changes the dataset version.
+    key = (id(matrix), dataVersion()[0], variant)
+    if key not in targetCache:
+        values = dict(Nutrient.objects.values_list("pk", variants[variant]))
+        targetCache.clear()
+        targetCache[key] = np.array([values.get(nutrientId) or np.nan for nutrientId in matrix.nutrients], dtype=np.float64)
+    return targetCache[key]
+
+
+def optimise(weights=None, variant="rdi", basis="weight", bodyWeight=None, foodGroup=None, tags=None, limit=50, directory=matrixDirectory):
+    """
+    Score every food as the weighted sum of its capped nutrient densities
+    against the chosen targets and return the best (food id, score) pairs.
+    weights maps nutrient ids to weights, by default every nutrient with a target counts once.
+    """
+    matrix = getMatrix(directory)
+    targets = targetVector(matrix, variant)
+    if variant == "kg":
+        targets = targets * bodyWeight
+    weightVector = np.zeros(len(matrix.nutrients), dtype=np.float64)
+    if weights:
+        for nutrientId, weight in weights.items():
+            if nutrientId in matrix.nutrientIndex:
+                weightVector[matrix.nutrientIndex[nutrientId]] = weight
+    else:
+        weightVector[:] = 1
+    with np.errstate(invalid="ignore"):
+        usable = ~np.isnan(targets) & (targets > 0) & (weightVector != 0)
+    if not usable.any():
+        # No nutrient has a target in this variant, every food would score 0.
+        return []
+    rows = filteredRows(matrix, foodGroup, tags)
+    values = matrix.values[:, usable] if rows is None else matrix.values[rows][:, usable]
+    if basis == "calorie":
+        calories = matrix.column(ENERGY) if rows is None else matrix.column(ENERGY)[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            perCalorie = np.where(calories > 0, referenceCalories / calories, 0).astype(np.float32)
+        values = values * perCalorie.reshape(-1, 1)
+    densities = np.minimum(values / targets[usable].astype(np.float32), densityCap)
+    return matrix.top(densities.dot(weightVector[usable].astype(np.float32)), limit, rows)
@@ -0,0 +1,88 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+import json
+
+defaultPageSize = 250
+
+
+def after(fields, values):
+    """
+    Rows that sort after values on fields: (a > x) or (a = x and b > y) or ...
+    The redundant a >= x lets the database start the index scan at the cursor.
+    """
+    condition = Q()
+    for position, field in enumerate(fields):
+        equal = dict(zip(fields[:position], values[:position]))
+        equal["%s__gt" % field] = values[position]
+        condition |= Q(**equal)
+    return Q(**{"%s__gte" % fields[0]: values[0]}) & condition
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Pages ordered on the natural key of the view (keyset_fields) that continue
+    after the last row of the previous page, so a page deep into the table
+    costs as much as the first one. Follow next until it is null to read a
+    whole table. ?page= still gives page number pagination.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.page_query_param not in request.query_params
+        if not self.keyset:
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+        self.request = request
+        # Foreign keys by their column, ordering on the relation would use the ordering of the related model.
+        fields = [queryset.model._meta.get_field(field).attname for field in view.keyset_fields]
+        pageSize = self.get_page_size(request) or defaultPageSize
+        queryset = queryset.order_by(*fields)
+        if request.query_params.get(self.cursor_query_param):
+            queryset = queryset.filter(after(fields, self.decode(request.query_params[self.cursor_query_param], len(fields))))
+        rows = list(queryset[:pageSize + 1])
+        self.last = None
+        if len(rows) > pageSize:
+            rows = rows[:pageSize]
+            self.last = [getattr(rows[-1], field) for field in fields]
+        return rows
+
+    def decode(self, cursor, length):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode("ascii")))
+        except (TypeError, ValueError):
+            raise ParseError("Invalid cursor.")
+        if not isinstance(values, list) or len(values) != length:
+            raise ParseError("Invalid cursor.")
+        # The key values of a row, nested lists or objects would be compared as text.
+        if any(isinstance(value, bool) or not isinstance(value, (basestring, int, long, float)) for value in values):
+            raise ParseError("Invalid cursor.")
+        return values
+
+    def get_next_link(self):
+        if self.keyset:
+            if self.last is None:
+                return None
+            cursor = urlsafe_b64encode(json.dumps(self.last))
+            return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+        return super(KeysetPagination, self).get_next_link()
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([("next", self.get_next_link()), ("results", data)]))
+
+
+class RankingPagination(PageNumberPagination):
+    """
+    Numbered pages that are always on, for routes that must not return whole lists.
+    """
+    page_size = api_settings.PAGE_SIZE or defaultPageSize
+    page_size_query_param = "page_size"
+    max_page_size = 1000
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from .models import Food, NutrientData, NutrientRank
+
+# Energy in kcal, the calorie basis divides by it (see scores.py).
+ENERGY = "208"
+rankBatchSize = 5000
+# Kept small so the IN lists stay below the SQLite variable limit.
+foodBatchSize = 500
+
+
+def rankedRows(nutrients=None):
+    """
+    (nutrient, basis, rank, food, food group, amount) of every nutrient value
+    of the nutrients (all when None), ranked per nutrient from the highest
+    amount per 100 grams and per 100 kcal.
+    """
+    groups = dict(Food.objects.values_list("pk", "food_group"))
+    data = NutrientData.objects.all() if nutrients is None else NutrientData.objects.filter(nutrient__in=list(nutrients))
+    values = defaultdict(list)
+    for food, nutrient, ounce in data.values_list("food", "nutrient", "ounce").iterator():
+        if ounce is not None:
+            values[nutrient].append((food, float(ounce)))
+    if nutrients is None or ENERGY in nutrients:
+        energy = dict(values.get(ENERGY, ()))
+    else:
+        energy = dict((food, float(ounce)) for food, ounce in NutrientData.objects.filter(nutrient=ENERGY).values_list("food", "ounce")
+                      if ounce is not None)
+    for nutrient, amounts in values.items():
+        perCalorie = [(food, amount * 100 / energy[food]) for food, amount in amounts if energy.get(food, 0) > 0]
+        for basis, ranked in (("weight", amounts), ("calorie", perCalorie)):
+            ranked.sort(key=lambda pair: (-pair[1], pair[0]))
+            for rank, (food, amount) in enumerate(ranked, 1):
+                yield (nutrient, basis, rank, food, groups[food], amount)
+
+
+def buildRankings(batchSize=rankBatchSize, nutrients=None):
+    """
+    Rank the nutrients again, all of them when nutrients is None. Returns the number of ranked values.
+    """
+    quote = connection.ops.quote_name
+    columns = [NutrientRank._meta.get_field(name).column for name in ("nutrient", "basis", "rank", "food", "food_group", "amount")]
+    insert = "INSERT INTO %s (%s) VALUES (%s)" % (quote(NutrientRank._meta.db_table), ", ".join(quote(column) for column in columns),
+                                                  ", ".join(["%s"] * len(columns)))
+    total = 0
+    with transaction.atomic():
+        if nutrients is None:
+            NutrientRank.objects.all().delete()
+        else:
+            NutrientRank.objects.filter(nutrient__in=list(nutrients)).delete()
+        cursor = connection.cursor()
+        batch = []
+        for row in rankedRows(nutrients):
+            batch.append(row)
+            if len(batch) >= batchSize:
+                cursor.executemany(insert, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+            total += len(batch)
+    return total
+
+
+def updateFoodGroups(foods, batchSize=foodBatchSize):
+    """
+    Copy the food group of the foods to their ranks, after the foods changed.
+    """
+    foods = sorted(foods)
+    with transaction.atomic():
+        for start in xrange(0, len(foods), batchSize):
+            byGroup = defaultdict(list)
+            for food, group in Food.objects.filter(pk__in=foods[start:start + batchSize]).values_list("pk", "food_group"):
+                byGroup[group].append(food)
+            for group, members in byGroup.items():
+                NutrientRank.objects.filter(food__in=members).exclude(food_group=group).update(food_group=group)
+
+
+def nutrientsOf(foods, batchSize=foodBatchSize):
+    """
+    The nutrients the foods have a value for.
+    """
+    foods = sorted(foods)
+    nutrients = set()
+    for start in xrange(0, len(foods), batchSize):
+        nutrients.update(NutrientData.objects.filter(food__in=foods[start:start + batchSize]).values_list("nutrient", flat=True).distinct())
+    return nutrients
@@ -0,0 +1,119 @@
+from array import array
+from threading import Lock
+from django.conf import settings
+from django.http import Http404
+from rest_framework.response import Response
+from .models import Food, FoodGroup, Nutrient, Source, Derivation, LanguaLFactor, DataSource, NutrientData, Weight
+from .cache import dataVersion
+
+# Set USDA_READ_REPLICA = True to keep a copy of the reference tables, the
+# foods and the nutrient values and weights of every food in each process.
+# The detail GETs of those models and the recipe totals are then answered
+# without SQL. It is reloaded when the dataset version changes. Call
+# getReplica() in the WSGI module and start gunicorn with --preload, so the
+# forked workers share the pages of one copy.
+replicaModels = (FoodGroup, Nutrient, Source, Derivation, LanguaLFactor, DataSource, Food)
+lock = Lock()
+current = None
+
+
+class Table(object):
+    """
+    Rows of one model as tuples in primary key order, with an index on the primary key.
+    """
+    __slots__ = ("fields", "index", "rows")
+
+    def __init__(self, model):
+        fields = model._meta.concrete_fields
+        self.fields = tuple(field.name for field in fields)
+        self.rows = list(model.objects.order_by("pk").values_list(*[field.attname for field in fields]))
+        position = [field.primary_key for field in fields].index(True)
+        self.index = dict((row[position], i) for i, row in enumerate(self.rows))
+
+    def get(self, pk):
+        if pk not in self.index:
+            return None
+        return dict(zip(self.fields, self.rows[self.index[pk]]))
+
+
+class FoodNutrients(object):
+    __slots__ = ("nutrients", "amounts")
+
+    def __init__(self):
+        self.nutrients = []
+        self.amounts = array("d")
+
+
+class FoodWeights(object):
+    __slots__ = ("sequences", "grams")
+
+    def __init__(self):
+        self.sequences = []
+        self.grams = array("d")
+
+
+class Replica(object):
+    __slots__ = ("version", "tables", "nutrients", "weights")
+
+    def __init__(self, version):
+        self.version = version
+        self.tables = dict((model, Table(model)) for model in replicaModels)
+        self.nutrients = {}
+        for food, nutrient, ounce in NutrientData.objects.order_by("food_id", "nutrient_id").values_list("food", "nutrient", "ounce").iterator():
+            if ounce is not None:
+                values = self.nutrients.get(food) or self.nutrients.setdefault(food, FoodNutrients())
+                values.nutrients.append(nutrient)
+                values.amounts.append(ounce)
+        self.weights = {}
+        for food, sequence, amount, grams in Weight.objects.order_by("food_id", "sequence").values_list("food", "sequence", "amount", "grams").iterator():
+            weights = self.weights.get(food) or self.weights.setdefault(food, FoodWeights())
+            weights.sequences.append(sequence)
+            weights.grams.append(grams / amount if amount else grams)
+
+    def unitGrams(self, foods):
+        """
+        Grams of one unit of every Weight of the foods by (food, sequence).
+        """
+        grams = {}
+        for food in foods:
+            weights = self.weights.get(food)
+            if weights is not None:
+                grams.update(((food, sequence), weight) for sequence, weight in zip(weights.sequences, weights.grams))
+        return grams
+
+    def nutrientValues(self, foods):
+        for food in foods:
+            values = self.nutrients.get(food)
+            if values is not None:
+                for nutrient, amount in zip(values.nutrients, values.amounts):
+                    yield food, nutrient, amount
+
+
+def getReplica():
+    """
+    The replica of the current dataset version, None unless USDA_READ_REPLICA is set.
+    """
+    global current
+    if not getattr(settings, "USDA_READ_REPLICA", False):
+        return None
+    version = dataVersion()[0]
+    with lock:
+        if current is None or current.version != version:
+            current = Replica(version)
+        return current
+
+
+class ReplicaMixin(object):
+    """
+    Answers retrieve from the replica for the replicated models.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        replica = getReplica()
+        model = self.get_queryset().model
+        if replica is None or model not in replica.tables:
+            return super(ReplicaMixin, self).retrieve(request, *args, **kwargs)
+        row = replica.tables[model].get(kwargs.get(self.lookup_url_kwarg or self.lookup_field))
+        if row is None:
+            raise Http404
+        return Response(dict((name, row[name]) for name in self.get_serializer_class().Meta.fields if name in row))
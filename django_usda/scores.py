@@ -0,0 +1,206 @@
+from django.db import connection, transaction
+from .models import Food, Nutrient, NutrientData
+from .matrix import matrixDirectory
+import numpy as np
+import hashlib
+import json
+import os
+
+# Derived scores, computed from the nutrient matrix (amounts per 100 grams):
+#
+#   calories                 energy (208) in kcal
+#   energy_density           kcal per gram
+#   insulin_load             carbohydrate (205) + 0.56 * protein (203), in grams
+#   insulin_load_optimiser   as insulin_load, with net carbohydrate (carbohydrate - fibre (291))
+#   insulinogenic            percentage of the calories from insulin_load (4 kcal per gram)
+#   insulinogenic_optimiser  as insulinogenic, from insulin_load_optimiser
+#   wilders_formula          ketogenic ratio (0.9 F + 0.46 P) / (C + 0.58 P + 0.1 F)
+#   ketonumber               as wilders_formula, with net carbohydrate
+#   nd_weight                sum of the per nutrient nd_weight of the food
+#   nd_calorie               sum of the per nutrient nd_calorie of the food
+#   il_score, ed_score       0-100 rank of insulinogenic and energy_density over all foods, 100 is the lowest
+#   il/ed_optimiser_score    the same for insulinogenic_optimiser and the energy density without fibre
+#
+# Per nutrient (NutrientData), for nutrients with an rdi:
+#
+#   raw_nd_weight            amount / rdi
+#   raw_nd_calorie           amount per 2000 kcal of the food / rdi
+#   adjusted_nd_*            the raw value capped at densityCap
+#   optimiser_nd_calorie     amount per 2000 kcal / oni_male (rdi when unset), capped at densityCap
+
+ENERGY, PROTEIN, FAT, CARBOHYDRATE, FIBRE = "208", "203", "204", "205", "291"
+# One nutrient far above its target should not outweigh all the others.
+densityCap = 1.0
+referenceCalories = 2000.0
+fingerprintFile = "fingerprints.json"
+# The matrix is float32, which holds about 7 significant digits, so the
+# scores are written rounded to those instead of as 29.7819995880127.
+significantDigits = 7
+
+foodScoreFields = ("calories", "energy_density", "insulin_load", "insulin_load_optimiser", "insulinogenic", "insulinogenic_optimiser",
+                   "wilders_formula", "ketonumber", "nd_weight", "nd_calorie", "il_score", "ed_score", "il_optimiser_score", "ed_optimiser_score")
+# Ranks over all foods, one changed food moves those of the others.
+rankScoreFields = ("il_score", "ed_score", "il_optimiser_score", "ed_optimiser_score")
+nutrientScoreFields = ("raw_nd_weight", "adjusted_nd_weight", "raw_nd_calorie", "adjusted_nd_calorie", "optimiser_nd_calorie")
+
+
+def nutrientColumn(matrix, nutrientId):
+    if nutrientId not in matrix.nutrientIndex:
+        return np.zeros(len(matrix.foods), dtype=np.float32)
+    return np.asarray(matrix.column(nutrientId), dtype=np.float64)
+
+
+def targets(matrix, field, fallback=None):
+    values = dict(Nutrient.objects.values_list("pk", field))
+    if fallback:
+        for pk, value in Nutrient.objects.values_list("pk", fallback):
+            if not values.get(pk):
+                values[pk] = value
+    # Nutrients without a target get NaN, so they drop out of every density.
+    return np.array([values.get(nutrientId) or np.nan for nutrientId in matrix.nutrients], dtype=np.float64)
+
+
+def lowerIsBetter(values):
+    scores = np.full(len(values), np.nan)
+    known = ~np.isnan(values)
+    if known.sum() > 1:
+        ranks = values[known].argsort(kind="mergesort").argsort(kind="mergesort")
+        scores[known] = 100 - ranks * 100.0 / (known.sum() - 1)
+    elif known.any():
+        scores[known] = 100
+    return scores
+
+
+def nutrientScores(matrix, calories):
+    values = np.asarray(matrix.values, dtype=np.float64)
+    rdi = targets(matrix, "rdi")
+    oni = targets(matrix, "oni_male", fallback="rdi")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        perCalorie = np.where(calories > 0, referenceCalories / calories, np.nan).reshape(-1, 1)
+        rawWeight = values / rdi
+        rawCalorie = values * perCalorie / rdi
+        optimiserCalorie = np.minimum(values * perCalorie / oni, densityCap)
+    return {
+        "raw_nd_weight": rawWeight,
+        "adjusted_nd_weight": np.minimum(rawWeight, densityCap),
+        "raw_nd_calorie": rawCalorie,
+        "adjusted_nd_calorie": np.minimum(rawCalorie, densityCap),
+        "optimiser_nd_calorie": optimiserCalorie,
+    }
+
+
+def foodScores(matrix, densities):
+    calories = nutrientColumn(matrix, ENERGY)
+    protein = nutrientColumn(matrix, PROTEIN)
+    fat = nutrientColumn(matrix, FAT)
+    carbohydrate = nutrientColumn(matrix, CARBOHYDRATE)
+    fibre = nutrientColumn(matrix, FIBRE)
+    netCarbohydrate = np.maximum(carbohydrate - fibre, 0)
+    scores = {"calories": calories, "energy_density": calories / 100}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores["insulin_load"] = carbohydrate + 0.56 * protein
+        scores["insulin_load_optimiser"] = netCarbohydrate + 0.56 * protein
+        scores["insulinogenic"] = np.where(calories > 0, scores["insulin_load"] * 400 / calories, np.nan)
+        scores["insulinogenic_optimiser"] = np.where(calories > 0, scores["insulin_load_optimiser"] * 400 / calories, np.nan)
+        ketogenic = 0.9 * fat + 0.46 * protein
+        scores["wilders_formula"] = np.where(carbohydrate + 0.58 * protein + 0.1 * fat > 0,
+                                             ketogenic / (carbohydrate + 0.58 * protein + 0.1 * fat), np.nan)
+        scores["ketonumber"] = np.where(netCarbohydrate + 0.58 * protein + 0.1 * fat > 0,
+                                        ketogenic / (netCarbohydrate + 0.58 * protein + 0.1 * fat), np.nan)
+    scores["nd_weight"] = np.nansum(densities["adjusted_nd_weight"], axis=1)
+    scores["nd_calorie"] = np.nansum(densities["adjusted_nd_calorie"], axis=1)
+    scores["il_score"] = lowerIsBetter(scores["insulinogenic"])
+    scores["ed_score"] = lowerIsBetter(scores["energy_density"])
+    scores["il_optimiser_score"] = lowerIsBetter(scores["insulinogenic_optimiser"])
+    scores["ed_optimiser_score"] = lowerIsBetter((calories - 2 * fibre) / 100)
+    return scores
+
+
+def fingerprints(matrix):
+    values = np.ascontiguousarray(matrix.values)
+    return dict((foodId, hashlib.md5(values[row].tobytes()).hexdigest()) for row, foodId in enumerate(matrix.foods))
+
+
+def loadFingerprints(directory=matrixDirectory):
+    path = os.path.join(directory, fingerprintFile)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def saveFingerprints(prints, directory=matrixDirectory):
+    path = os.path.join(directory, fingerprintFile)
+    with open(path + ".tmp", "w") as file:
+        json.dump(prints, file)
+    os.rename(path + ".tmp", path)
+
+
+def toValue(value):
+    if value is None or np.isnan(value) or np.isinf(value):
+        return None
+    return float("%.*g" % (significantDigits, value))
+
+
+def bulkUpdate(cursor, model, fields, rows):
+    """
+    One UPDATE per row by primary key, sent with executemany. rows hold the field values followed by the primary key.
+    """
+    quote = connection.ops.quote_name
+    assignments = ", ".join("%s = %%s" % quote(model._meta.get_field(field).column) for field in fields)
+    cursor.executemany("UPDATE %s SET %s WHERE %s = %%s" % (quote(model._meta.db_table), assignments, quote(model._meta.pk.column)), rows)
+
+
+def updateInBatches(cursor, model, fields, rows, batchSize):
+    """
+    bulkUpdate the rows batchSize at a time, returns the number of rows.
+    """
+    updated = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batchSize:
+            bulkUpdate(cursor, model, fields, batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        bulkUpdate(cursor, model, fields, batch)
+        updated += len(batch)
+    return updated
+
+
+def nutrientDataKeys(foodIds, everything):
+    keys = NutrientData.objects.values_list("pk", "food_id", "nutrient_id")
+    if everything:
+        for key in keys.iterator():
+            yield key
+        return
+    # Kept small so the IN lists stay below the SQLite variable limit.
+    for start in xrange(0, len(foodIds), 500):
+        for key in keys.filter(food__in=list(foodIds[start:start + 500])):
+            yield key
+
+
+def writeScores(matrix, foodIds, batchSize):
+    """
+    Compute every score in one pass over the matrix and write those of the
+    given foods back, and the rankScoreFields of every food. Returns the
+    number of foods, ranked foods and nutrient values written.
+    """
+    calories = nutrientColumn(matrix, ENERGY)
+    densities = nutrientScores(matrix, calories)
+    scores = foodScores(matrix, densities)
+    rows = matrix.rows(foodIds)
+    changed = set(foodIds)
+    others = [(row, foodId) for row, foodId in enumerate(matrix.foods) if foodId not in changed]
+    cursor = connection.cursor()
+    with transaction.atomic():
+        updateInBatches(cursor, Food, foodScoreFields, ([toValue(scores[field][row]) for field in foodScoreFields] + [foodId]
+                                                        for row, foodId in zip(rows, foodIds)), batchSize)
+        updateInBatches(cursor, Food, rankScoreFields, ([toValue(scores[field][row]) for field in rankScoreFields] + [foodId]
+                                                        for row, foodId in others), batchSize)
+    with transaction.atomic():
+        updated = updateInBatches(cursor, NutrientData, nutrientScoreFields, (
+            [toValue(densities[field][matrix.foodIndex[foodId], matrix.nutrientIndex[nutrientId]]) for field in nutrientScoreFields] + [pk]
+            for pk, foodId, nutrientId in nutrientDataKeys(foodIds, len(foodIds) == len(matrix.foods))), batchSize)
+    return len(foodIds), len(matrix.foods), updated
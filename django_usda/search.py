@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from rest_framework import filters
+from .models import Food
+import re
+
+# Set USDA_SEARCH_BACKEND = "fulltext" to search foods with the full text
+# search of PostgreSQL or SQLite (FTS5). Other databases, and the default
+# "filter", use the Django Rest Framework SearchFilter.
+searchFields = ("long_description", "ingredient_name")
+# Kept small so the IN lists stay below the SQLite variable limit.
+refreshBatchSize = 500
+
+
+def column(name, qualified=True):
+    quoted = connection.ops.quote_name(Food._meta.get_field(name).column)
+    if qualified:
+        return "%s.%s" % (connection.ops.quote_name(Food._meta.db_table), quoted)
+    return quoted
+
+
+class PostgresFoodSearch(object):
+
+    def document(self, qualified=True):
+        return "to_tsvector('english', %s)" % " || ' ' || ".join("coalesce(%s, '')" % column(name, qualified) for name in searchFields)
+
+    def build(self):
+        # The queries use the same expression, so PostgreSQL answers them from this index.
+        cursor = connection.cursor()
+        cursor.execute("CREATE INDEX IF NOT EXISTS django_usda_food_search ON %s USING GIN ((%s))" % (
+            connection.ops.quote_name(Food._meta.db_table), self.document(qualified=False)))
+
+    def refresh(self, ids):
+        # The expression index follows every change of the table.
+        pass
+
+    def query(self, terms):
+        return " & ".join("%s:*" % term for term in terms)
+
+    def search(self, queryset, query, ranked):
+        queryset = queryset.extra(where=["%s @@ to_tsquery('english', %%s)" % self.document()], params=[query])
+        if ranked:
+            queryset = queryset.extra(select={"search_rank": "ts_rank(%s, to_tsquery('english', %%s))" % self.document()},
+                                      select_params=[query], order_by=["-search_rank"])
+        return queryset
+
+
+class SqliteFoodSearch(object):
+    table = "django_usda_food_fts"
+
+    def build(self):
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % self.table)
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(food_id UNINDEXED, %s, prefix='2 3')" % (self.table, ", ".join(searchFields)))
+        cursor.execute("INSERT INTO %s (food_id, %s) SELECT %s, %s FROM %s" % (
+            self.table, ", ".join(searchFields), column("id"), ", ".join(column(name) for name in searchFields),
+            connection.ops.quote_name(Food._meta.db_table)))
+
+    def refresh(self, ids):
+        """
+        Index the foods again, foods that no longer exist are removed.
+        """
+        cursor = connection.cursor()
+        if self.table not in connection.introspection.table_names(cursor):
+            self.build()
+            return
+        ids = sorted(ids)
+        for start in xrange(0, len(ids), refreshBatchSize):
+            part = ids[start:start + refreshBatchSize]
+            placeholders = ", ".join(["%s"] * len(part))
+            cursor.execute("DELETE FROM %s WHERE food_id IN (%s)" % (self.table, placeholders), part)
+            cursor.execute("INSERT INTO %s (food_id, %s) SELECT %s, %s FROM %s WHERE %s IN (%s)" % (
+                self.table, ", ".join(searchFields), column("id"), ", ".join(column(name) for name in searchFields),
+                connection.ops.quote_name(Food._meta.db_table), column("id"), placeholders), part)
+
+    def query(self, terms):
+        return " ".join('"%s"*' % term for term in terms)
+
+    def search(self, queryset, query, ranked):
+        if not ranked:
+            return queryset.extra(where=["%s IN (SELECT food_id FROM %s WHERE %s MATCH %%s)" % (column("id"), self.table, self.table)], params=[query])
+        # Joined, so the index is matched once and every row carries its rank.
+        # bm25 ranks are negative, the best match has the lowest value.
+        return queryset.extra(tables=[self.table], where=["%s.food_id = %s" % (self.table, column("id")), "%s MATCH %%s" % self.table],
+                              params=[query], select={"search_rank": "%s.rank" % self.table}, order_by=["search_rank"])
+
+
+fullTextBackends = {
+    "postgresql": PostgresFoodSearch(),
+    "sqlite": SqliteFoodSearch(),
+}
+
+
+def searchBackend():
+    if getattr(settings, "USDA_SEARCH_BACKEND", "filter") != "fulltext":
+        return None
+    return fullTextBackends.get(connection.vendor)
+
+
+def buildSearchIndex():
+    backend = searchBackend()
+    if backend is None:
+        return False
+    backend.build()
+    return True
+
+
+def refreshSearchIndex(ids):
+    backend = searchBackend()
+    if backend is None:
+        return False
+    backend.refresh(ids)
+    return True
+
+
+def searchTerms(term):
+    return re.findall(r"\w+", term, re.UNICODE)
+
+
+class FoodSearchFilter(filters.BaseFilterBackend):
+    """
+    Ranked full text search with prefix matching on ?search= and food group
+    filtering on ?food_group=. Falls back to the SearchFilter on search_fields.
+    """
+
+    def search(self, request, queryset, view, ranked=True):
+        backend = searchBackend()
+        if backend is None:
+            return filters.SearchFilter().filter_queryset(request, queryset, view)
+        terms = searchTerms(request.GET.get("search", ""))
+        if not terms:
+            return queryset
+        return backend.search(queryset, backend.query(terms), ranked)
+
+    def filter_queryset(self, request, queryset, view):
+        queryset = self.search(request, queryset, view)
+        if request.GET.get("food_group"):
+            queryset = queryset.filter(food_group=request.GET["food_group"])
+        return queryset
+
+    def facets(self, request, queryset, view):
+        queryset = self.search(request, queryset, view, ranked=False)
+        return list(queryset.order_by().values("food_group").annotate(count=Count("pk")).order_by("-count"))
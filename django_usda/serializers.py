@@ -0,0 +1,142 @@
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource
+from rest_framework import serializers
+from django.db.models import Prefetch
+
+
+class NutrientDataSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = NutrientData
+        fields = ("food", "nutrient", "ounce", "data_type", "raw_nd_weight", "adjusted_nd_weight", "raw_nd_calorie", "adjusted_nd_calorie",
+                  "optimiser_nd_calorie")
+
+
+class FoodSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Food
+        fields = ("id", "food_group", "long_description")
+
+
+class FoodGroupSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = FoodGroup
+        fields = ("id", "name")
+
+
+class FoodLanguaLFactorSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = FoodLanguaLFactor
+        fields = ("food", "langual_factor")
+
+
+class LanguaLFactorSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = LanguaLFactor
+        fields = ("id", "name")
+
+
+class NutrientSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Nutrient
+        fields = ("id", "units", "tagname", "name", "decimals", "order")
+
+
+class SourceSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Source
+        fields = ("id", "name")
+
+
+class DerivationSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Derivation
+        fields = ("id", "name")
+
+
+class WeightSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Weight
+        fields = ("food", "sequence", "amount", "name",
+                  "grams", "data_points", "standard_derivation")
+
+
+class FootnoteSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Footnote
+        fields = ("food", "sequence", "type", "nutrient", "name")
+
+
+class DataSourceSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = DataSource
+        fields = ("id", "authors", "name", "year", "journal",
+                  "volume", "issue_state", "start_page", "end_page")
+
+
+class DataLinkSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = DataLink
+        fields = ("food", "nutrient", "data_source")
+
+
+# The serializers to get all related Food information, used by FoodInfoViewSet and the food documents.
+
+
+class FoodLanguaLFactorInfoSerializer(serializers.ModelSerializer):
+    langual_factor = LanguaLFactorSerializer()
+
+    class Meta:
+        model = FoodLanguaLFactor
+        fields = ("langual_factor",)
+
+
+class DataLinkInfoSerializer(serializers.ModelSerializer):
+    data_source = DataSourceSerializer()
+
+    class Meta:
+        model = DataLink
+        fields = ("data_source",)
+
+
+class NutrientDataInfoSerializer(serializers.ModelSerializer):
+    nutrient = NutrientSerializer()
+    data_type = SourceSerializer()
+
+    class Meta:
+        model = NutrientData
+        fields = ("nutrient", "ounce", "data_type")
+
+
+class FoodInfoSerializer(serializers.ModelSerializer):
+    food_group = FoodGroupSerializer()
+    footnote_set = FootnoteSerializer(many=True)
+    nutrientdata_set = NutrientDataInfoSerializer(many=True)
+    weight_set = WeightSerializer(many=True)
+    foodlangualfactor_set = FoodLanguaLFactorInfoSerializer(many=True)
+    datalink_set = DataLinkInfoSerializer(many=True)
+
+    class Meta:
+        model = Food
+        fields = ("id", "food_group", "long_description", 'footnote_set', 'nutrientdata_set', 'weight_set', 'foodlangualfactor_set', 'datalink_set')
+
+
+# Every nested relation of FoodInfoSerializer is fetched up front, so a page
+# costs the same fixed number of queries regardless of its size.
+foodInfoPrefetch = (
+    "footnote_set",
+    Prefetch("nutrientdata_set", queryset=NutrientData.objects.select_related("nutrient", "data_type")),
+    "weight_set",
+    Prefetch("foodlangualfactor_set", queryset=FoodLanguaLFactor.objects.select_related("langual_factor")),
+    Prefetch("datalink_set", queryset=DataLink.objects.select_related("data_source")),
+)
@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+from threading import local
+
+# The food documents and the dataset version follow every saved and
+# deleted row. Bulk changes, which rebuild both once at the end, defer
+# those handlers in their thread.
+state = local()
+
+
+@contextmanager
+def deferSignals():
+    state.deferred = True
+    try:
+        yield
+    finally:
+        state.deferred = False
+
+
+def deferred():
+    return getattr(state, "deferred", False)
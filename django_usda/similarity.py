@@ -0,0 +1,58 @@
+from threading import Lock
+from .models import Nutrient
+from .matrix import matrixDirectory, getMatrix, filteredRows
+import numpy as np
+import os
+
+# Unit-length nutrient profiles of the foods, one row per row of the
+# nutrient matrix, so cosine similarity is a single matrix-vector product.
+indexFile = "similarity.npy"
+lock = Lock()
+loaded = {}
+
+
+def profiles(matrix):
+    """
+    Every amount as a fraction of the rdi of its nutrient, so grams and micrograms
+    weigh the same, normalized to unit length. Nutrients without an rdi are left out.
+    """
+    rdi = dict(Nutrient.objects.values_list("pk", "rdi"))
+    targets = np.array([rdi.get(nutrientId) or 0 for nutrientId in matrix.nutrients], dtype=np.float32)
+    vectors = matrix.values[:, targets > 0] / targets[targets > 0]
+    norms = np.linalg.norm(vectors, axis=1).reshape(-1, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(norms > 0, vectors / norms, 0).astype(np.float32)
+
+
+def buildSimilarityIndex(matrix=None, directory=matrixDirectory):
+    matrix = matrix if matrix is not None else getMatrix(directory)
+    path = os.path.join(directory, indexFile)
+    with open(path + ".tmp", "wb") as file:
+        np.save(file, profiles(matrix))
+    os.rename(path + ".tmp", path)
+
+
+def similarityIndex(matrix, directory=matrixDirectory):
+    path = os.path.join(directory, indexFile)
+    with lock:
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(os.path.join(directory, "values.npy")):
+            buildSimilarityIndex(matrix, directory)
+        modified = os.path.getmtime(path)
+        if loaded.get("modified") != (path, modified):
+            loaded["index"] = np.load(path, mmap_mode="r")
+            loaded["modified"] = (path, modified)
+        return loaded["index"]
+
+
+def similarFoods(foodId, k=10, foodGroup=None, tags=None, directory=matrixDirectory):
+    """
+    The k (food id, cosine similarity) pairs closest to the food, which is left out.
+    Raises KeyError for foods that are not in the matrix.
+    """
+    matrix = getMatrix(directory)
+    index = similarityIndex(matrix, directory)
+    row = matrix.foodIndex[foodId]
+    rows = filteredRows(matrix, foodGroup, tags)
+    scores = index.dot(index[row]) if rows is None else index[rows].dot(index[row])
+    scores[(np.arange(len(matrix.foods)) if rows is None else rows) == row] = -np.inf
+    return [(food, score) for food, score in matrix.top(scores, k, rows) if score > -np.inf]
@@ -0,0 +1,101 @@
+from django.apps import apps
+from .export import batches, exportBatchSize
+from .models import DatasetVersion
+import pyarrow as pa
+import json
+import os
+
+# Every table is an Arrow IPC file (<Model>.arrow), which can be memory
+# mapped and read without copying. Foreign keys are dictionary encoded
+# against the primary keys of the related table, so the strings of the
+# repeated NDB and nutrient numbers are stored once per column.
+manifestFile = "manifest.json"
+arrowTypes = {
+    "AutoField": pa.int64(),
+    "IntegerField": pa.int64(),
+    "FloatField": pa.float64(),
+    "DecimalField": pa.float64(),
+    "BooleanField": pa.bool_(),
+    "DateTimeField": pa.timestamp("us"),
+    "CharField": pa.string(),
+    "SlugField": pa.string(),
+    "TextField": pa.string(),
+}
+
+
+class Column(object):
+
+    def __init__(self, field):
+        self.name = field.name
+        self.attname = field.attname
+        if field.is_relation:
+            keys = list(field.related_model.objects.order_by("pk").values_list("pk", flat=True))
+            self.positions = dict((key, position) for position, key in enumerate(keys))
+            self.dictionary = pa.array(keys, type=arrowTypes[field.related_model._meta.pk.get_internal_type()])
+            self.type = pa.dictionary(pa.int32(), self.dictionary.type)
+        else:
+            self.positions = None
+            self.type = arrowTypes[field.get_internal_type()]
+            self.float = pa.types.is_floating(self.type)
+
+    def array(self, values):
+        if self.positions is not None:
+            indices = pa.array([None if value is None else self.positions[value] for value in values], type=pa.int32())
+            return pa.DictionaryArray.from_arrays(indices, self.dictionary)
+        if self.float:
+            values = [None if value is None else float(value) for value in values]
+        return pa.array(values, type=self.type)
+
+
+def recordBatches(model, columns, batchSize):
+    names = [column.name for column in columns]
+    empty = True
+    for batch in batches(model.objects.all(), [column.attname for column in columns], batchSize):
+        empty = False
+        yield pa.RecordBatch.from_arrays([column.array(values) for column, values in zip(columns, zip(*batch))], names)
+    if empty:
+        # Readers need the dictionaries, which are only written with a batch.
+        yield pa.RecordBatch.from_arrays([column.array([]) for column in columns], names)
+
+
+def writeTable(model, path, batchSize=exportBatchSize):
+    columns = [Column(field) for field in model._meta.concrete_fields]
+    rows = 0
+    writer = None
+    with open(path + ".tmp", "wb") as file:
+        for batch in recordBatches(model, columns, batchSize):
+            # The writer takes the schema of the first batch, which carries the dictionaries.
+            if writer is None:
+                writer = pa.RecordBatchFileWriter(file, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+        writer.close()
+    os.rename(path + ".tmp", path)
+    return rows
+
+
+def exportSnapshot(directory, batchSize=exportBatchSize):
+    """
+    Write every table to directory and return the manifest with the row counts.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    version = DatasetVersion.objects.first()
+    manifest = {"release": version.release if version else None, "tables": {}}
+    for model in apps.get_app_config("django_usda").get_models():
+        fileName = "%s.arrow" % model.__name__
+        manifest["tables"][model.__name__] = {"file": fileName, "rows": writeTable(model, os.path.join(directory, fileName), batchSize)}
+    with open(os.path.join(directory, manifestFile), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def loadSnapshot(directory):
+    """
+    The tables of a snapshot as memory-mapped pyarrow Tables by model name,
+    use table.to_pandas() for a DataFrame.
+    """
+    with open(os.path.join(directory, manifestFile)) as file:
+        manifest = json.load(file)
+    return dict((name, pa.RecordBatchFileReader(pa.memory_map(os.path.join(directory, table["file"]))).read_all())
+                for name, table in manifest["tables"].items())
@@ -0,0 +1,699 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+from .models import Food, FoodGroup, FoodLanguaLFactor, LanguaLFactor, NutrientData, Nutrient, Source, Derivation, Weight, Footnote, DataLink, DataSource, FoodDocument, NutrientRank, DatasetVersion
+from .modelviewsets import FoodViewSet, FoodInfoViewSet, NutrientDataViewSet, FoodLanguaLFactorViewSet, DataLinkViewSet, NutrientViewSet, LanguaLFactorViewSet, WeightViewSet, \
+    FoodGroupViewSet, SourceViewSet, DerivationViewSet, DataSourceViewSet, nutrientTotals
+from .rankings import buildRankings
+from .documents import buildDocuments
+from .export import batches
+from .search import buildSearchIndex
+from .autocomplete import getIndex, resetIndex
+from .cache import touchDataVersion, bumpDataVersion, dataVersion
+from .replica import getReplica
+from . import replica
+from .signals import deferSignals
+from .management.commands.import_r27 import dropIndexes, createIndexes
+from .management.commands import import_r27, import_sr_delta
+from unittest import skipUnless
+try:
+    from .matrix import NutrientMatrix, buildMatrix
+    from .scores import writeScores
+    from .optimiser import optimise
+    from .similarity import similarFoods
+except ImportError:
+    NutrientMatrix = None
+from base64 import urlsafe_b64encode
+from cStringIO import StringIO
+from functools import partial
+from urlparse import urlparse, parse_qsl
+import csv
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+
+def createFoods(count, nutrients=3):
+    """
+    count foods with every related table filled, the nutrients are 201, 202, ...
+    """
+    group = FoodGroup.objects.create(id="0100", name="Dairy and Egg Products")
+    source = Source.objects.create(id="1", name="Analytical or derived from analytical")
+    factor = LanguaLFactor.objects.create(id="A0001", name="Dairy")
+    dataSource = DataSource.objects.create(id="S0001", name="Composition of Foods")
+    Nutrient.objects.bulk_create([Nutrient(id=str(201 + i), units="g", name="Nutrient %s" % i, decimals=2, order=i, rdi=10.0)
+                                  for i in xrange(nutrients)])
+    Food.objects.bulk_create([Food(id="%05d" % (1001 + i), food_group=group, long_description="Food %s" % i) for i in xrange(count)])
+    foods = list(Food.objects.order_by("pk").values_list("pk", flat=True))
+    NutrientData.objects.bulk_create([NutrientData(food_id=food, nutrient_id=str(201 + i), ounce=position + i, data_type=source)
+                                      for position, food in enumerate(foods) for i in xrange(nutrients)])
+    Weight.objects.bulk_create([Weight(food_id=food, sequence=str(sequence), amount=1, name="cup", grams=100.0 * sequence)
+                                for food in foods for sequence in (1, 2)])
+    Footnote.objects.bulk_create([Footnote(food_id=food, sequence="01", type="N", nutrient_id="201", name="Note") for food in foods])
+    FoodLanguaLFactor.objects.bulk_create([FoodLanguaLFactor(food_id=food, langual_factor=factor) for food in foods])
+    DataLink.objects.bulk_create([DataLink(food_id=food, nutrient_id="201", data_source=dataSource) for food in foods])
+    return foods
+
+
+def writeZip(directory, files):
+    """
+    A zip of SR files in directory, files maps the file names to their rows of values.
+    """
+    path = os.path.join(directory, "release.zip")
+    openedZipFile = zipfile.ZipFile(path, "w")
+    for fileName, rows in files.items():
+        openedZipFile.writestr(fileName, "".join("%s\r\n" % "^".join(
+            "~%s~" % value if isinstance(value, basestring) else str(value) for value in row) for row in rows))
+    openedZipFile.close()
+    return path
+
+
+def quietly(function, *args, **kwargs):
+    """
+    Call function without the progress the commands print.
+    """
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout = stdout
+
+
+class PageSizePagination(PageNumberPagination):
+    page_size_query_param = "page_size"
+
+
+class FoodInfoQueryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        createFoods(30)
+
+    def setUp(self):
+        cache.clear()
+        self.view = FoodInfoViewSet.as_view({"get": "list"}, pagination_class=PageSizePagination, filter_backends=())
+        self.factory = APIRequestFactory()
+
+    def page(self, size):
+        response = self.view(self.factory.get("/foodinfo/", {"page_size": size}))
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_nested_relations(self):
+        food = self.page(1)[0]
+        self.assertEqual(food["food_group"]["name"], "Dairy and Egg Products")
+        self.assertEqual([weight["sequence"] for weight in food["weight_set"]], ["1", "2"])
+        self.assertEqual(len(food["nutrientdata_set"]), 3)
+        self.assertEqual(food["nutrientdata_set"][0]["data_type"]["id"], "1")
+        self.assertEqual(food["foodlangualfactor_set"], [{"langual_factor": {"id": "A0001", "name": "Dairy"}}])
+
+    def test_queries_do_not_grow_with_the_page_size(self):
+        self.page(1)
+        # The count, the foods with their food group and one query per prefetched relation.
+        for size in (5, 25):
+            with self.assertNumQueries(7):
+                self.assertEqual(len(self.page(size)), size)
+
+
+class FoodDocumentTest(TestCase):
+
+    def setUp(self):
+        createFoods(3)
+        buildDocuments()
+
+    def document(self, food):
+        return json.loads(FoodDocument.objects.get(pk=food).document)
+
+    def test_document_matches_foodinfo(self):
+        cache.clear()
+        view = FoodInfoViewSet.as_view({"get": "retrieve"})
+        response = view(APIRequestFactory().get("/foodinfo/01001/"), pk="01001")
+        self.assertEqual(self.document("01001"), json.loads(json.dumps(response.data)))
+
+    def test_saved_and_deleted_rows_refresh_the_document(self):
+        Weight.objects.filter(food="01001", sequence="2").update(grams=5.0)
+        weight = Weight.objects.get(food="01001", sequence="2")
+        weight.save()
+        self.assertEqual([value["grams"] for value in self.document("01001")["weight_set"]], [100.0, 5.0])
+        NutrientData.objects.get(food="01001", nutrient="202").delete()
+        self.assertEqual([value["nutrient"]["id"] for value in self.document("01001")["nutrientdata_set"]], ["201", "203"])
+
+    def test_saved_and_deleted_reference_rows_refresh_the_documents(self):
+        group = FoodGroup.objects.get(pk="0100")
+        group.name = "Dairy"
+        group.save()
+        nutrient = Nutrient.objects.get(pk="201")
+        nutrient.name = "Protein"
+        nutrient.save()
+        for food in ("01001", "01002", "01003"):
+            self.assertEqual(self.document(food)["food_group"]["name"], "Dairy")
+            self.assertEqual(self.document(food)["nutrientdata_set"][0]["nutrient"]["name"], "Protein")
+        with CaptureQueriesContext(connection) as queries:
+            LanguaLFactor.objects.get(pk="A0001").delete()
+        self.assertEqual(self.document("01001")["foodlangualfactor_set"], [])
+        # Once for the deleted factor, not once per deleted food LanguaL factor.
+        self.assertEqual(len([query for query in queries.captured_queries if 'INSERT INTO "django_usda_fooddocument"' in query["sql"]]), 1)
+
+    def test_deleted_food_has_no_document(self):
+        Food.objects.get(pk="01002").delete()
+        self.assertFalse(FoodDocument.objects.filter(pk="01002").exists())
+        self.assertEqual(FoodDocument.objects.count(), 2)
+
+
+@skipUnless(connection.vendor == "sqlite", "Tests the SQLite FTS5 backend.")
+@override_settings(USDA_SEARCH_BACKEND="fulltext")
+class SqliteFoodSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        foods = createFoods(4)
+        for food, description in zip(foods, ("Cheese, blue", "Butter, salted", "Cheese, cheddar, cheese sauce", "Milk, whole")):
+            Food.objects.filter(pk=food).update(long_description=description)
+        buildSearchIndex()
+        self.view = FoodViewSet.as_view({"get": "list"})
+
+    def test_ranked_search_matches_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.view(APIRequestFactory().get("/foods/", {"search": "chee"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([food["long_description"] for food in response.data["results"]], ["Cheese, cheddar, cheese sauce", "Cheese, blue"])
+        self.assertNotIn("facets", response.data)
+        for query in queries.captured_queries:
+            self.assertLessEqual(query["sql"].count("MATCH"), 1)
+        # The count and the page.
+        self.assertEqual(len([query for query in queries.captured_queries if "MATCH" in query["sql"]]), 2)
+
+    def test_facets_on_request(self):
+        response = self.view(APIRequestFactory().get("/foods/", {"search": "chee", "facets": "1"}))
+        self.assertEqual(response.data["facets"], [{"food_group": "0100", "count": 2}])
+        with override_settings(USDA_SEARCH_BACKEND=None):
+            response = self.view(APIRequestFactory().get("/foods/", {"search": "chee", "facets": "1"}))
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertNotIn("facets", response.data)
+
+
+class AutocompleteIndexTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        resetIndex()
+        createFoods(2)
+
+    def test_rebuilt_when_the_data_version_changes(self):
+        self.assertEqual([food["id"] for food in getIndex().complete("food")], ["01001", "01002"])
+        Food.objects.filter(pk="01002").update(long_description="Yogurt")
+        self.assertEqual(getIndex().complete("yog"), [])
+        touchDataVersion()
+        self.assertEqual([food["id"] for food in getIndex().complete("yog")], ["01002"])
+
+
+@skipUnless(NutrientMatrix, "Requires NumPy.")
+class WriteScoresTest(TestCase):
+
+    def setUp(self):
+        # Nutrient 208 (energy) of the foods is 7, 8 and 9 kcal.
+        createFoods(3, nutrients=8)
+
+    def test_changed_foods_rerank_all_foods(self):
+        writeScores(NutrientMatrix.fromDatabase(), ["01001", "01002", "01003"], 2)
+        self.assertEqual(list(Food.objects.order_by("pk").values_list("ed_score", flat=True)), [100, 50, 0])
+        NutrientData.objects.filter(food="01001", nutrient="208").update(ounce=29.782)
+        self.assertEqual(writeScores(NutrientMatrix.fromDatabase(), ["01001"], 2)[:2], (1, 3))
+        self.assertEqual(list(Food.objects.order_by("pk").values_list("ed_score", flat=True)), [0, 100, 50])
+        self.assertEqual(Food.objects.get(pk="01001").calories, 29.782)
+
+
+class NutrientTotalsTest(TestCase):
+
+    def setUp(self):
+        createFoods(2)
+        self.view = NutrientDataViewSet.as_view({"post": "totals"})
+
+    def post(self, body):
+        return self.view(APIRequestFactory().post("/nutrientdatas/totals/", json.dumps(body), content_type="application/json"))
+
+    def test_totals(self):
+        response = self.post({"ingredients": [{"food": "01001", "sequence": "2", "amount": 0.5}, {"food": "01002", "grams": 50}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["grams"], 150)
+        self.assertEqual([nutrient["amount"] for nutrient in response.data["nutrients"]], [0.5, 2, 3.5])
+
+    def test_invalid_bodies(self):
+        for body in ([{"food": "01001", "grams": 100}], "01001", {"ingredients": [{"food": "01001", "grams": -1}]},
+                     {"ingredients": [{"food": "01001", "grams": float("nan")}]}, {"ingredients": [{"food": "01001", "grams": "inf"}]},
+                     {"ingredients": [{"food": "01001", "sequence": "1", "amount": float("-inf")}]}):
+            self.assertEqual(self.post(body).status_code, 400, body)
+
+
+class DataVersionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        createFoods(1)
+
+    def test_saved_and_deleted_rows_change_the_version(self):
+        version = dataVersion()
+        food = Food.objects.get(pk="01001")
+        food.save()
+        self.assertNotEqual(dataVersion(), version)
+        version = dataVersion()
+        Weight.objects.filter(food=food, sequence="1").delete()
+        self.assertNotEqual(dataVersion(), version)
+        # Edits only count in the cache, the imports stay the only DatasetVersions.
+        self.assertFalse(DatasetVersion.objects.exists())
+
+    def test_an_import_after_edits_changes_the_version(self):
+        Food.objects.get(pk="01001").save()
+        version = dataVersion()
+        DatasetVersion.objects.create(release="SR28", tables="{}")
+        bumpDataVersion()
+        self.assertNotEqual(dataVersion()[0], version[0])
+
+    def test_deferred_changes_keep_the_version(self):
+        version = dataVersion()
+        with deferSignals():
+            Food.objects.get(pk="01001").save()
+        self.assertEqual(dataVersion(), version)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        createFoods(2)
+
+    def get(self, view, path, pk=None, **headers):
+        return view(APIRequestFactory().get(path, **headers), **({"pk": pk} if pk else {}))
+
+    def test_matching_etag_is_not_modified(self):
+        view = FoodViewSet.as_view({"get": "retrieve"})
+        response = self.get(view, "/foods/01001/", "01001")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get(view, "/foods/01001/", "01001", HTTP_IF_NONE_MATCH='"other", %s' % etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get(view, "/foods/01002/", "01002", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.get(view, "/foods/01001/", "01001", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_data_changes_the_etag(self):
+        view = FoodViewSet.as_view({"get": "retrieve"})
+        etag = self.get(view, "/foods/01001/", "01001")["ETag"]
+        Food.objects.filter(pk="01001").update(long_description="Cheese")
+        Food.objects.get(pk="01001").save()
+        response = self.get(view, "/foods/01001/", "01001", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["long_description"], "Cheese")
+
+    def test_cached_list_follows_the_version(self):
+        view = NutrientViewSet.as_view({"get": "list"})
+        self.assertEqual(len(self.get(view, "/nutrients/").data["results"]), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.get(view, "/nutrients/").data["results"]), 3)
+        Nutrient.objects.get(pk="203").delete()
+        self.assertEqual(len(self.get(view, "/nutrients/").data["results"]), 2)
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        createFoods(2)
+        self.view = WeightViewSet.as_view({"get": "export"})
+
+    def export(self, params):
+        response = self.view(APIRequestFactory().get("/weights/export/", params))
+        return response, "".join(response.streaming_content) if response.status_code == 200 else None
+
+    def test_ndjson(self):
+        response, content = self.export({})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row["food"], row["sequence"], row["grams"]) for row in rows],
+                         [("01001", "1", 100), ("01001", "2", 200), ("01002", "1", 100), ("01002", "2", 200)])
+        self.assertEqual(len(set(row["id"] for row in rows)), 4)
+
+    def test_filtered_csv(self):
+        response, content = self.export({"output": "csv", "food": "01002"})
+        self.assertEqual(response["Content-Disposition"], "attachment; filename=django_usda_weight.csv")
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([(row["food"], row["sequence"], row["name"]) for row in rows], [("01002", "1", "cup"), ("01002", "2", "cup")])
+
+    def test_batches(self):
+        batchSizes = [len(batch) for batch in batches(Weight.objects.all(), ["id", "food_id"], 3)]
+        self.assertEqual(batchSizes, [3, 1])
+
+    def test_unknown_output(self):
+        self.assertEqual(self.export({"output": "xml"})[0].status_code, 400)
+
+
+class ReplicaTest(TestCase):
+
+    def setUp(self):
+        replica.current = None
+        createFoods(2)
+        Derivation.objects.create(id="A", name="Analytical")
+        Weight.objects.filter(food="01002", sequence="2").update(amount=4)
+
+    def tearDown(self):
+        replica.current = None
+
+    def responses(self):
+        """
+        The detail GETs of every replicated model and the recipe totals.
+        """
+        # A new version, so the cached views read again.
+        touchDataVersion()
+        responses = []
+        for viewSet, pk in ((FoodViewSet, "01002"), (FoodGroupViewSet, "0100"), (NutrientViewSet, "202"), (SourceViewSet, "1"),
+                            (DerivationViewSet, "A"), (LanguaLFactorViewSet, "A0001"), (DataSourceViewSet, "S0001"),
+                            (FoodViewSet, "09999")):
+            response = viewSet.as_view({"get": "retrieve"})(APIRequestFactory().get("/"), pk=pk)
+            responses.append((response.status_code, response.data))
+        responses.append(nutrientTotals([{"food": "01001", "sequence": "2", "amount": 0.5}, {"food": "01002", "sequence": "2", "amount": 2},
+                                         {"food": "01002", "grams": 50}]))
+        return responses
+
+    def test_same_responses_as_the_database(self):
+        expected = self.responses()
+        with override_settings(USDA_READ_REPLICA=True):
+            self.assertEqual(self.responses(), expected)
+            self.assertIsNotNone(replica.current)
+            with self.assertNumQueries(0):
+                nutrientTotals([{"food": "01001", "grams": 100}])
+
+    def test_reloaded_after_a_change(self):
+        with override_settings(USDA_READ_REPLICA=True):
+            loaded = getReplica()
+            self.assertIs(getReplica(), loaded)
+            NutrientData.objects.filter(food="01001", nutrient="201").update(ounce=5)
+            Food.objects.get(pk="01001").save()
+            self.assertIsNot(getReplica(), loaded)
+            changed = self.responses()
+        self.assertEqual(changed, self.responses())
+        self.assertEqual(dict((nutrient["nutrient"], nutrient["amount"]) for nutrient in changed[-1]["nutrients"])["201"], 6.5)
+
+
+@skipUnless(connection.vendor == "sqlite", "Reads the SQLite query plans.")
+class CompositeIndexTest(TestCase):
+
+    def setUp(self):
+        createFoods(20)
+
+    def indexName(self, model, fields):
+        columns = [model._meta.get_field(field).column for field in fields]
+        constraints = connection.introspection.get_constraints(connection.cursor(), model._meta.db_table)
+        return [name for name, constraint in constraints.items() if constraint["index"] and constraint["columns"] == columns][0]
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN %s" % sql, params)
+        return " ".join(row[-1] for row in cursor.fetchall())
+
+    def test_lookups_use_the_composite_indexes(self):
+        for model, fields, queryset in (
+                (NutrientData, ("nutrient", "ounce", "food"), NutrientData.objects.filter(nutrient="201").order_by("-ounce").values_list("food", "ounce")),
+                (Footnote, ("food", "nutrient"), Footnote.objects.filter(food="01001", nutrient="201")),
+                (Food, ("food_group", "long_description"), Food.objects.filter(food_group="0100").order_by("long_description"))):
+            self.assertIn(self.indexName(model, fields), self.plan(queryset))
+        self.assertIn("COVERING INDEX", self.plan(NutrientData.objects.filter(nutrient="201").order_by("-ounce").values_list("food", "ounce")))
+
+    def test_deferred_indexes_are_dropped_and_rebuilt(self):
+        queryset = NutrientData.objects.filter(nutrient="201").order_by("-ounce").values_list("food", "ounce")
+        name = self.indexName(NutrientData, ("nutrient", "ounce", "food"))
+        dropIndexes([NutrientData])
+        self.assertNotIn(name, self.plan(queryset))
+        createIndexes([NutrientData])
+        self.assertIn(self.indexName(NutrientData, ("nutrient", "ounce", "food")), self.plan(queryset))
+        self.assertEqual(NutrientData.objects.count(), 60)
+
+
+class BatchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        createFoods(30)
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+
+    def batch(self, viewset, ids):
+        response = viewset.as_view({"get": "batch"})(self.factory.get("/batch/", {"ids": ",".join(ids)}))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_order_of_the_ids_without_unknown_ids(self):
+        foods = self.batch(FoodViewSet, ["01003", "99999", "01001", "01003"])
+        self.assertEqual([food["id"] for food in foods], ["01003", "01001"])
+        self.assertEqual(foods[0]["long_description"], "Food 2")
+        self.assertEqual([food["id"] for food in self.batch(FoodInfoViewSet, ["01002", "01001", "00000"])], ["01002", "01001"])
+
+    def test_ids_are_required_and_limited(self):
+        view = FoodViewSet.as_view({"get": "batch"})
+        self.assertEqual(view(self.factory.get("/batch/")).status_code, 400)
+        self.assertEqual(view(self.factory.get("/batch/", {"ids": ",".join("%05d" % i for i in xrange(101))})).status_code, 400)
+
+    def test_queries_do_not_grow_with_the_ids(self):
+        self.batch(FoodInfoViewSet, ["01001"])
+        # The foods with their food group and one query per prefetched relation.
+        for count in (2, 30):
+            with self.assertNumQueries(6):
+                self.assertEqual(len(self.batch(FoodInfoViewSet, ["%05d" % (1001 + i) for i in xrange(count)])), count)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.batch(FoodViewSet, ["%05d" % (1001 + i) for i in xrange(30)])), 30)
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        createFoods(30)
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+
+    def test_next_reads_every_row_once(self):
+        for viewset, model, fields in ((NutrientDataViewSet, NutrientData, ("food_id", "nutrient_id")),
+                                       (FoodLanguaLFactorViewSet, FoodLanguaLFactor, ("food_id", "langual_factor_id")),
+                                       (DataLinkViewSet, DataLink, ("food_id", "nutrient_id", "data_source_id"))):
+            view = viewset.as_view({"get": "list"})
+            params, keys, pages = {"page_size": 7}, [], 0
+            while params is not None:
+                response = view(self.factory.get("/", params))
+                self.assertEqual(response.status_code, 200)
+                keys += [tuple(row[field.rsplit("_", 1)[0]] for field in fields) for row in response.data["results"]]
+                pages += 1
+                params = dict(parse_qsl(urlparse(response.data["next"]).query)) if response.data["next"] else None
+            self.assertEqual(keys, list(model.objects.order_by(*fields).values_list(*fields)))
+            self.assertEqual(pages, (len(keys) + 6) // 7)
+            self.assertEqual(view(self.factory.get("/", {"page": 1})).status_code, 200)
+
+    def test_invalid_cursors(self):
+        view = NutrientDataViewSet.as_view({"get": "list"})
+        for cursor in ("not base64!", urlsafe_b64encode("[1]"), urlsafe_b64encode("[[1], [2]]"), urlsafe_b64encode('[{"a": 1}, "201"]'),
+                       urlsafe_b64encode("[true, 1]")):
+            self.assertEqual(view(self.factory.get("/", {"cursor": cursor})).status_code, 400, cursor)
+
+
+class NutrientTopTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        createFoods(5)
+        buildRankings()
+        self.factory = APIRequestFactory()
+        self.view = NutrientViewSet.as_view({"get": "top"})
+
+    def test_top_foods(self):
+        response = self.view(self.factory.get("/nutrients/202/top/"), pk="202")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(rank["rank"], rank["food"], rank["amount"]) for rank in response.data["results"]],
+                         [(1, "01005", 5), (2, "01004", 4), (3, "01003", 3), (4, "01002", 2), (5, "01001", 1)])
+        self.assertEqual(self.view(self.factory.get("/nutrients/202/top/", {"basis": "volume"}), pk="202").status_code, 400)
+        self.assertEqual(self.view(self.factory.get("/nutrients/999/top/"), pk="999").status_code, 404)
+
+    def test_id_filters(self):
+        for viewset, params, count in ((NutrientViewSet, {"id": "201"}, 1), (LanguaLFactorViewSet, {"id": "A0001"}, 1),
+                                       (WeightViewSet, {"food": "01001"}, 2)):
+            response = viewset.as_view({"get": "list"})(self.factory.get("/", params))
+            self.assertEqual(response.status_code, 200)
+            results = response.data["results"] if isinstance(response.data, dict) else response.data
+            self.assertEqual(len(results), count)
+
+
+class ImportEngineTest(TestCase):
+
+    def setUp(self):
+        createFoods(2)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, engine, fileName, model, rows):
+        openedZipFile = zipfile.ZipFile(writeZip(self.directory, {fileName: rows}))
+        try:
+            with deferSignals():
+                return quietly(import_r27.engines[engine], openedZipFile.open(fileName), fileName, model, 2)
+        finally:
+            openedZipFile.close()
+
+    def test_upsert_updates_and_inserts(self):
+        rows = [("01001", "0100", "Changed"), ("01002", "0100", "Food 1"), ("01005", "0100", "New")]
+        for run in xrange(2):
+            self.load("upsert", "FOOD_DES.txt", Food, rows)
+            self.assertEqual(list(Food.objects.order_by("pk").values_list("pk", "long_description")),
+                             [("01001", "Changed"), ("01002", "Food 1"), ("01005", "New")])
+        self.load("upsert", "WEIGHT.txt", Weight, [("01001", "2", 1, "tbsp", 15), ("01005", "1", 1, "cup", 240)])
+        self.assertEqual(Weight.objects.get(food="01001", sequence="2").grams, 15)
+        self.assertEqual(Weight.objects.get(food="01005", sequence="1").name, "cup")
+        self.assertEqual(Weight.objects.count(), 5)
+
+    def test_upsert_replaces_the_rows_without_a_key(self):
+        self.load("upsert", "FOOTNOTE.txt", Footnote, [("01001", "01", "D", "", "First"), ("01001", "02", "N", "201", "Second")])
+        self.assertEqual(list(Footnote.objects.filter(food="01001").order_by("sequence").values_list("name", flat=True)), ["First", "Second"])
+        self.assertEqual(Footnote.objects.filter(food="01002").count(), 1)
+
+    def test_copy(self):
+        self.load("copy", "DERIV_CD.txt", Derivation, [("A", "Analytical"), ("B", "Calculated"), ("C", "Imputed")])
+        self.assertEqual(list(Derivation.objects.order_by("pk").values_list("pk", "name")), [("A", "Analytical"), ("B", "Calculated"), ("C", "Imputed")])
+        # A duplicate key rolls the whole file back.
+        self.assertIs(self.load("copy", "DERIV_CD.txt", Derivation, [("D", "Assumed"), ("A", "Again")]), False)
+        self.assertEqual(Derivation.objects.count(), 3)
+
+
+class SrDeltaTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        createFoods(4, nutrients=8)
+        FoodGroup.objects.create(id="0200", name="Spices and Herbs")
+        buildDocuments()
+        buildRankings()
+        self.directory = tempfile.mkdtemp()
+        self.matrixFunctions = import_sr_delta.updateMatrix, getattr(import_sr_delta, "buildSimilarityIndex", None)
+        if NutrientMatrix:
+            buildMatrix(self.directory)
+            import_sr_delta.updateMatrix = partial(import_sr_delta.updateMatrix, directory=self.directory)
+            import_sr_delta.buildSimilarityIndex = partial(import_sr_delta.buildSimilarityIndex, directory=self.directory)
+
+    def tearDown(self):
+        import_sr_delta.updateMatrix, import_sr_delta.buildSimilarityIndex = self.matrixFunctions
+        shutil.rmtree(self.directory)
+
+    def apply(self, files):
+        quietly(call_command, "import_sr_delta", writeZip(self.directory, files))
+        return json.loads(FoodDocument.objects.get(pk="01001").document)
+
+    def assertRebuilt(self):
+        """
+        What the delta refreshed equals rebuilding everything.
+        """
+        documents = dict(FoodDocument.objects.values_list("food", "document"))
+        ranks = sorted(NutrientRank.objects.values_list("nutrient", "basis", "rank", "food", "food_group", "amount"))
+        if NutrientMatrix:
+            saved, current = NutrientMatrix.load(self.directory), NutrientMatrix.fromDatabase()
+            self.assertEqual(list(saved.foods), list(current.foods))
+            self.assertEqual(saved.values.tolist(), current.values.tolist())
+        buildDocuments()
+        buildRankings()
+        self.assertEqual(documents, dict(FoodDocument.objects.values_list("food", "document")))
+        self.assertEqual(ranks, sorted(NutrientRank.objects.values_list("nutrient", "basis", "rank", "food", "food_group", "amount")))
+
+    def test_changed_rows(self):
+        document = self.apply({
+            "CHG_NDEF.txt": [("202", "g", "", "Renamed", 2, 1)],
+            "CHG_FOOD.txt": [("01002", "0200", "Moved")],
+            "CHG_NUTR.txt": [("01001", "208", 50, "", "", "1")],
+            "DEL_NUTR.txt": [("01003", "203")],
+        })
+        self.assertEqual(document["nutrientdata_set"][1]["nutrient"]["name"], "Renamed")
+        self.assertEqual(NutrientRank.objects.get(nutrient="208", basis="weight", rank=1).food_id, "01001")
+        self.assertEqual(NutrientRank.objects.filter(food="01002").exclude(food_group="0200").count(), 0)
+        self.assertRebuilt()
+
+    def test_deleted_food(self):
+        self.apply({"DEL_FOOD.txt": [("01004", "Gone")]})
+        self.assertFalse(Food.objects.filter(pk="01004").exists())
+        self.assertEqual(NutrientRank.objects.get(nutrient="201", basis="weight", rank=1).food_id, "01003")
+        self.assertRebuilt()
+
+
+@skipUnless(NutrientMatrix, "Requires NumPy.")
+class OptimiserTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Every nutrient has an rdi of 10, food n has n - 1, n and n + 1 of nutrients 201 to 203.
+        createFoods(3)
+        self.directory = tempfile.mkdtemp()
+        buildMatrix(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ranks_against_the_targets(self):
+        ranked = optimise(directory=self.directory)
+        self.assertEqual([food for food, score in ranked], ["01003", "01002", "01001"])
+        self.assertAlmostEqual(ranked[0][1], 0.9, places=5)
+        self.assertEqual([food for food, score in optimise({"201": 1}, limit=1, directory=self.directory)], ["01003"])
+
+    def test_edited_targets_are_used(self):
+        self.assertEqual(len(optimise({"203": 1}, directory=self.directory)), 3)
+        nutrient = Nutrient.objects.get(pk="203")
+        nutrient.rdi = None
+        nutrient.save()
+        self.assertEqual(optimise({"203": 1}, directory=self.directory), [])
+
+    def test_variant_without_targets(self):
+        self.assertEqual(optimise(variant="kg", bodyWeight=70, directory=self.directory), [])
+
+    def test_invalid_parameters(self):
+        view = FoodViewSet.as_view({"get": "optimise"})
+        for params in ({"variant": "kg"}, {"variant": "kg", "body_weight": 0}, {"variant": "kg", "body_weight": -70},
+                       {"variant": "kg", "body_weight": "nan"}, {"basis": "volume"}, {"variant": "child"}, {"nutrients": "203"}):
+            self.assertEqual(view(APIRequestFactory().get("/foods/optimise/", params)).status_code, 400, params)
+
+
+@skipUnless(NutrientMatrix, "Requires NumPy.")
+class SimilarityTest(TestCase):
+
+    def setUp(self):
+        # Food n has n - 1, n and n + 1 of nutrients 201 to 203, 01004 only has nutrient 201.
+        createFoods(4)
+        NutrientData.objects.filter(food="01004").update(ounce=0)
+        NutrientData.objects.filter(food="01004", nutrient="201").update(ounce=9)
+        self.directory = tempfile.mkdtemp()
+        buildMatrix(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_closest_profiles_first(self):
+        similar = similarFoods("01003", directory=self.directory)
+        self.assertEqual([food for food, score in similar], ["01002", "01001", "01004"])
+        self.assertTrue(similar[0][1] > similar[1][1] > similar[2][1])
+        (food, score), = similarFoods("01004", 1, directory=self.directory)
+        self.assertEqual(food, "01003")
+        self.assertAlmostEqual(score, 2 / math.sqrt(29), places=5)
+
+    def test_filters(self):
+        group = FoodGroup.objects.create(id="0200", name="Spices and Herbs")
+        Food.objects.filter(pk="01002").update(food_group=group)
+        self.assertEqual([food for food, score in similarFoods("01003", 2, "0100", directory=self.directory)], ["01001", "01004"])
+        self.assertEqual(similarFoods("01003", 2, "0200", directory=self.directory)[0][0], "01002")
+        self.assertEqual(similarFoods("01002", 2, "0200", directory=self.directory), [])
+        self.assertRaises(KeyError, similarFoods, "09999", directory=self.directory)
@@ -19,6 +19,10 @@ setup(
     install_requires=[
         'djangorestframework',
     ],
+    extras_require={
+        'matrix': ['numpy'],
+        'snapshot': ['pyarrow'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',